@@ -8,6 +8,9 @@ import argparse
 import pickle
 
 import math
+import zlib
+import itertools
+import multiprocessing
 
 
 def genConfig(seq_path, set_type):
@@ -18,8 +21,6 @@ def genConfig(seq_path, set_type):
     if set_type == 'OTB':
         ############################################  have to refine #############################################
 
-        img_list = sorted([seq_path + '/img/' + p for p in os.listdir(seq_path + '/img') if os.path.splitext(p)[1] == '.jpg'])
-
         if (seqname == 'Jogging_1') or (seqname == 'Skating2_1'):
             gt = np.loadtxt(seq_path + '/groundtruth_rect.1.txt')
         elif (seqname == 'Jogging_2') or (seqname == 'Skating2_2'):
@@ -37,19 +38,29 @@ def genConfig(seq_path, set_type):
         else:
             gt = np.loadtxt(seq_path + '/groundtruth_rect.txt', delimiter=',')
 
+        ## frames [start, stop) of the sequence
+        start, stop = 0, None
         if seqname == 'David':
-            img_list = img_list[299:]
+            start = 299
           
         if seqname == 'Football1':
-            img_list = img_list[0:74]
+            stop = 74
         if seqname == 'Freeman3':
-            img_list = img_list[0:460]
+            stop = 460
         if seqname == 'Freeman4':
-            img_list = img_list[0:283]
+            stop = 283
         if seqname == 'Diving':
-            img_list = img_list[0:215]
+            stop = 215
         if seqname == 'Tiger1':
-            img_list = img_list[5:]
+            start = 5
+
+        ## a video file in the sequence directory is streamed directly, seeking to start
+        video_path = find_video(seq_path)
+        if video_path is not None:
+            img_list = VideoFrameSource(video_path, start, stop, opts['n_prefetch'])
+        else:
+            img_list = sorted([seq_path + '/img/' + p for p in os.listdir(seq_path + '/img') if os.path.splitext(p)[1] == '.jpg'])
+            img_list = img_list[start:stop]
 
         ##polygon to rect
     if gt.shape[1] == 8:
@@ -62,10 +73,68 @@ def genConfig(seq_path, set_type):
     return img_list, gt
 
 
+def sequence_seed(seq, seed):
+    ## seed of one sequence, independent of the sequence order and of the worker running it
+    return (seed + zlib.crc32(seq)) & 0x7fffffff
+
+
+def init_worker(worker_opts):
+    ## options of the main process, whatever the start method of the pool
+    opts.update(worker_opts)
+    ## the model is loaded before any sequence seeds the rngs, as in the serial run,
+    ## so that loading it does not shift the random draws of the first sequence
+    cached_model()
+
+
+def sequence_result_path(seq):
+    ## every finished sequence is saved next to result_path, in <result_path>_seqs/<seq>.npz
+    return os.path.join(os.path.splitext(opts['result_path'])[0] + '_seqs', seq + '.npz')
+
+
+def save_sequence_result(seq, iou_result, result_bb, fps, result_nobb, **extra):
+    path = sequence_result_path(seq)
+    if not isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            ## created by another worker meanwhile
+            pass
+    ## written aside and renamed, an interrupted write never looks like a finished sequence
+    tmp_path = '%s.%d.tmp.npz' % (path, os.getpid())
+    np.savez(tmp_path, iou_result=iou_result, result_bb=result_bb, fps=fps, result_nobb=result_nobb, **extra)
+    os.rename(tmp_path, path)
+
+
+def load_sequence_result(seq):
+    data = np.load(sequence_result_path(seq))
+    return data['iou_result'], data['result_bb'], float(data['fps']), data['result_nobb']
+
+
+def eval_sequence(job):
+    num, seq, seq_path, seed = job
+    img_list,gt=genConfig(seq_path,opts['set_type'])
+
+    if seed is not None:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        if opts['use_gpu']:
+            torch.cuda.manual_seed(seed)
+
+    iou_result, result_bb, fps, result_nobb = run_mdnet(img_list, gt[0], gt, seq = seq, display=opts['visualize'])
+    extra = dict()
+    if opts['profile_stages']:
+        ## per frame stage times (n_frames x n_stages seconds) next to the results
+        extra['stage_names'], extra['stage_times'] = stage_timer.table()
+        print '{} stage times:\n{}'.format(seq, stage_timer.report())
+    save_sequence_result(seq, iou_result, result_bb, fps, result_nobb, **extra)
+    return num, seq, iou_result, result_bb, fps, result_nobb
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-set_type", default = 'OTB' )
+    parser.add_argument("-dataset_path", default = '/home/ilchae/dataset/tracking/')
     parser.add_argument("-model_path", default = './models/rt-mdnet.pth')
     parser.add_argument("-result_path", default = './result.npy')
     parser.add_argument("-visual_log",default=False, action= 'store_true')
@@ -73,6 +142,15 @@ if __name__ == "__main__":
     parser.add_argument("-adaptive_align",default=True, action='store_false')
     parser.add_argument("-padding",default=1.2, type = float)
     parser.add_argument("-jitter",default=True, action='store_false')
+    parser.add_argument("-cpu",default=False, action='store_true')
+    parser.add_argument("-n_threads",default=0, type = int)
+    parser.add_argument("-frozen_layers",default=[], nargs='*')
+    parser.add_argument("-quantize",default=False, action='store_true')
+    parser.add_argument("-compile",default=False, action='store_true')
+    parser.add_argument("-n_workers",default=0, type = int)
+    parser.add_argument("-seed",default=None, type = int)
+    parser.add_argument("-resume",default=False, action='store_true')
+    parser.add_argument("-profile",default=False, action='store_true')
 
     args = parser.parse_args()
 
@@ -89,20 +167,59 @@ if __name__ == "__main__":
     opts['adaptive_align'] = args.adaptive_align
     opts['padding'] = args.padding
     opts['jitter'] = args.jitter
+    opts['use_gpu'] = not args.cpu
+    if args.quantize and opts['use_gpu']:
+        ## checked here rather than after the initial training of the first sequence
+        parser.error('-quantize scores with int8 fc layers on cpu only, add -cpu')
+    opts['n_threads'] = args.n_threads
+    opts['frozen_layers'] = args.frozen_layers
+    opts['quantize_head'] = args.quantize
+    opts['compile_graphs'] = args.compile
+    opts['profile_stages'] = args.profile
     ##################################################################################
     ############################Do not modify opts anymore.###########################
     ######################Becuase of synchronization of options#######################
     ##################################################################################
+    if args.n_workers > 0:
+        ## sequences run in worker processes, each one loads its model and splits the cpu cores with the others
+        if opts['n_threads'] == 0 and not opts['use_gpu']:
+            opts['n_threads'] = max(1, multiprocessing.cpu_count() // args.n_workers)
+        opts['visualize'] = False
     print opts
 
 
     ## path initialization
-    dataset_path = '/home/ilchae/dataset/tracking/'
+    dataset_path = args.dataset_path
 
 
     seq_home = dataset_path + opts['set_type']
     seq_list = [f for f in os.listdir(seq_home) if isdir(join(seq_home,f))]
 
+    jobs = []
+    done = []
+    for num,seq in enumerate(seq_list):
+        if num<-1:
+            continue
+        ## sequences finished by a previous run are loaded, not tracked again
+        if args.resume and os.path.exists(sequence_result_path(seq)):
+            done.append((num, seq) + load_sequence_result(seq))
+            continue
+        seed = None if args.seed is None else sequence_seed(seq, args.seed)
+        jobs.append((num, seq, seq_home + '/' + seq, seed))
+    if args.resume:
+        print 'resume: {} sequences done, {} to run'.format(len(done), len(jobs))
+
+    if len(jobs) == 0:
+        results = iter([])
+    elif args.n_workers > 0:
+        pool = multiprocessing.Pool(args.n_workers, init_worker, (dict(opts),))
+        results = pool.imap_unordered(eval_sequence, jobs)
+    else:
+        ## the pretrained model is loaded once, every sequence copies its fc layers and shares its conv layers
+        cached_model()
+        results = (eval_sequence(job) for job in jobs)
+    results = itertools.chain(done, results)
+
     iou_list=[]
     fps_list=dict()
     bb_result = dict()
@@ -110,13 +227,7 @@ if __name__ == "__main__":
 
     iou_list_nobb=[]
     bb_result_nobb = dict()
-    for num,seq in enumerate(seq_list):
-        if num<-1:
-            continue
-        seq_path = seq_home + '/' + seq
-        img_list,gt=genConfig(seq_path,opts['set_type'])
-
-        iou_result, result_bb, fps, result_nobb = run_mdnet(img_list, gt[0], gt, seq = seq, display=opts['visualize'])
+    for num, seq, iou_result, result_bb, fps, result_nobb in results:
 
         enable_frameNum = 0.
         for iidx in range(len(iou_result)):
@@ -133,8 +244,11 @@ if __name__ == "__main__":
         bb_result_nobb[seq] = result_nobb
         print '{} {} : {} , total mIoU:{}, fps:{}'.format(num,seq,iou_result.mean(), sum(iou_list)/len(iou_list),sum(fps_list.values())/len(fps_list))
 
+    if args.n_workers > 0 and len(jobs) > 0:
+        pool.close()
+        pool.join()
+
     result['bb_result']=bb_result
     result['fps']=fps_list
     result['bb_result_nobb']=bb_result_nobb
     np.save(opts['result_path'],result)
-
@@ -0,0 +1,139 @@
+import os
+import sys
+import resource
+from os.path import join, isdir
+from Run import genConfig
+from tracker import *
+from synthetic import *
+import numpy as np
+
+import argparse
+
+
+def peak_memory():
+    ## peak resident memory of the process in MB (ru_maxrss is in KB on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def synthetic_sequences(data_dir, resolutions, motions, n_frames, seed):
+    ## (name, seq_path) of every resolution x motion, rendered once and reused by later runs
+    seqs = []
+    for resolution in resolutions:
+        width, height = [int(v) for v in resolution.split('x')]
+        for motion in motions:
+            name = 'synth_%dx%d_%s_%d' % (width, height, motion, n_frames)
+            seq_path = join(data_dir, name)
+            if not os.path.exists(join(seq_path, 'groundtruth_rect.txt')):
+                make_sequence(seq_path, n_frames, (width, height), (width // 10, height // 8), motion, seed=seed)
+            seqs.append((name, seq_path))
+    return seqs
+
+
+def bench_tracking(name, seq_path, seed, metrics):
+    img_list, gt = genConfig(seq_path, 'OTB')
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    iou_result, result_bb, fps, result_nobb = run_mdnet(img_list, gt[0], gt, seq = name)
+    metrics[name + '/fps'] = (fps, 'higher')
+    for stage_name, (mean, p50, p95, p99) in stage_timer.summary().iteritems():
+        metrics[name + '/' + stage_name + '_mean_ms'] = (mean*1000, 'lower')
+        metrics[name + '/' + stage_name + '_p95_ms'] = (p95*1000, 'lower')
+    ## the overlap only tells whether the tracker still works, it is not compared
+    metrics[name + '/miou'] = (iou_result[1:].mean(), None)
+
+
+def bench_pretrain_data(name, seq_path, receptive_field, n_batches, seed, metrics):
+    ## RegionDataset batches (image loading, cropping and roi sampling) of the pretraining loop
+    img_list, gt = genConfig(seq_path, 'OTB')
+    np.random.seed(seed)
+    dataset = RegionDataset(join(seq_path, 'img'), [os.path.basename(p) for p in img_list], gt, receptive_field, pretrain_opts)
+    times = []
+    for _ in range(n_batches):
+        tic = time.time()
+        dataset.next()
+        times.append(time.time()-tic)
+    metrics[name + '/pretrain_batch_mean_ms'] = (np.mean(times)*1000, 'lower')
+    metrics[name + '/pretrain_batch_p95_ms'] = (np.percentile(times, 95)*1000, 'lower')
+
+
+def compare(metrics, baseline, tolerance):
+    ## prints every metric against the baseline, returns the names of the regressed ones
+    regressions = []
+    print '{:<48} {:>12} {:>12} {:>8}'.format('metric', 'baseline', 'current', 'change')
+    for name, (value, better) in metrics.iteritems():
+        if name not in baseline:
+            print '{:<48} {:>12} {:>12.3f}'.format(name, '-', value)
+            continue
+        base = baseline[name][0]
+        change = (value - base) / base if base != 0 else 0.
+        regressed = (better == 'higher' and change < -tolerance) or (better == 'lower' and change > tolerance)
+        if regressed:
+            regressions.append(name)
+        print '{:<48} {:>12.3f} {:>12.3f} {:>+7.1f}% {}'.format(name, base, value, change*100, 'REGRESSION' if regressed else '')
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-data_dir", default = './bench_data')
+    parser.add_argument("-baseline", default = './bench_baseline.npy')
+    parser.add_argument("-save_baseline",default=False, action='store_true')
+    parser.add_argument("-tolerance",default=0.1, type = float)
+    parser.add_argument("-model_path", default = './models/rt-mdnet.pth')
+    parser.add_argument("-resolutions", default=['640x360', '1280x720'], nargs='*')
+    parser.add_argument("-motions", default=['linear', 'random_walk'], nargs='*')
+    parser.add_argument("-n_frames",default=60, type = int)
+    parser.add_argument("-n_pretrain_batches",default=10, type = int)
+    parser.add_argument("-seed",default=0, type = int)
+    parser.add_argument("-n_threads",default=4, type = int)
+
+    args = parser.parse_args()
+
+    ##################################################################################
+    #########################Just modify opts in this script.#########################
+    ######################Becuase of synchronization of options#######################
+    ##################################################################################
+    ## without the pretrained model the weights are random, the throughput is the same
+    opts['model_path'] = args.model_path if os.path.exists(args.model_path) else None
+    opts['use_gpu'] = False
+    opts['n_threads'] = args.n_threads
+    opts['visual_log'] = False
+    opts['profile_stages'] = True
+    pretrain_opts['use_gpu'] = False
+    ##################################################################################
+    ############################Do not modify opts anymore.###########################
+    ######################Becuase of synchronization of options#######################
+    ##################################################################################
+
+    torch.set_num_threads(opts['n_threads'])
+    torch.manual_seed(args.seed)
+    config = {'resolutions': args.resolutions, 'motions': args.motions, 'n_frames': args.n_frames,
+              'n_pretrain_batches': args.n_pretrain_batches, 'seed': args.seed, 'n_threads': args.n_threads,
+              'model_path': opts['model_path']}
+    print config
+
+    seqs = synthetic_sequences(args.data_dir, args.resolutions, args.motions, args.n_frames, args.seed)
+
+    metrics = OrderedDict()
+    model = cached_model()
+    for name, seq_path in seqs:
+        bench_tracking(name, seq_path, args.seed, metrics)
+    ## the pretraining data path does not depend on the motion, one sequence per resolution
+    for name, seq_path in seqs[::len(args.motions)]:
+        bench_pretrain_data(name, seq_path, model.receptive_field, args.n_pretrain_batches, args.seed, metrics)
+    metrics['peak_memory_mb'] = (peak_memory(), 'lower')
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        np.save(args.baseline, {'config': config, 'metrics': metrics})
+        print 'baseline saved to {}'.format(args.baseline)
+        compare(metrics, dict(), args.tolerance)
+        sys.exit(0)
+
+    baseline = np.load(args.baseline).item()
+    if baseline['config'] != config:
+        print 'warning: the baseline was recorded with {}'.format(baseline['config'])
+    regressions = compare(metrics, baseline['metrics'], args.tolerance)
+    if len(regressions) > 0:
+        print '{} metrics regressed by more than {:.0f}%'.format(len(regressions), args.tolerance*100)
+        sys.exit(1)
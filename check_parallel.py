@@ -0,0 +1,59 @@
+import os
+import sys
+import subprocess
+from os.path import join
+from tracker import *
+from synthetic import *
+import numpy as np
+
+import argparse
+
+
+def run(data_dir, model_path, n_workers, result_path, seed):
+    ## Run.py on the synthetic OTB set, single threaded so that the reductions are done in the same order
+    subprocess.check_call([sys.executable, 'Run.py', '-dataset_path', data_dir + '/', '-model_path', model_path,
+                           '-result_path', result_path, '-cpu', '-n_threads', '1', '-seed', str(seed),
+                           '-n_workers', str(n_workers)])
+    return os.path.splitext(result_path)[0] + '_seqs'
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-data_dir", default = './check_data')
+    parser.add_argument("-model_path", default = './models/rt-mdnet.pth')
+    parser.add_argument("-n_seqs",default=2, type = int)
+    parser.add_argument("-n_frames",default=10, type = int)
+    parser.add_argument("-seed",default=0, type = int)
+
+    args = parser.parse_args()
+
+    ## Run.py reads <dataset_path>/OTB/<seq>
+    seq_home = join(args.data_dir, 'OTB')
+    for s in range(args.n_seqs):
+        seq_path = join(seq_home, 'synth_check_%d' % (s))
+        if not os.path.exists(join(seq_path, 'groundtruth_rect.txt')):
+            make_sequence(seq_path, args.n_frames, (320, 240), (40, 32), MOTIONS[s % len(MOTIONS)], seed=args.seed + s)
+
+    ## without the pretrained model, a random one is saved and used by both runs
+    model_path = args.model_path
+    if not os.path.exists(model_path):
+        model_path = join(args.data_dir, 'random.pth')
+        torch.manual_seed(args.seed)
+        torch.save({'shared_layers': MDNet().layers.state_dict()}, model_path)
+
+    serial_dir = run(args.data_dir, model_path, 0, join(args.data_dir, 'serial.npy'), args.seed)
+    parallel_dir = run(args.data_dir, model_path, 2, join(args.data_dir, 'parallel.npy'), args.seed)
+
+    mismatches = []
+    for seq in sorted(os.listdir(seq_home)):
+        serial = np.load(join(serial_dir, seq + '.npz'))
+        parallel = np.load(join(parallel_dir, seq + '.npz'))
+        for key in ['result_bb', 'result_nobb']:
+            if not np.array_equal(serial[key], parallel[key]):
+                mismatches.append('%s/%s' % (seq, key))
+
+    if len(mismatches) > 0:
+        print 'serial and parallel runs differ: {}'.format(', '.join(mismatches))
+        sys.exit(1)
+    print 'serial and parallel runs give the same results on {} sequences'.format(len(os.listdir(seq_home)))
@@ -0,0 +1,87 @@
+import sys
+import torch
+
+sys.path.insert(0,'./modules')
+from roi_align.functions import roi_align_cpu
+from roi_align.functions.roi_align import roi_align as roi_align_cuda
+
+import argparse
+
+## (name, adjoint) of the kernels, the dense adaptive backward uses gaussian weights, it is not the adjoint of its forward
+VARIANTS = [('', True), ('ada_', True), ('dense_ada_', False)]
+
+
+def random_rois(n_rois, batch_size, height, width, spatial_scale, inside):
+    ## n_rois x [batch_idx,x1,y1,x2,y2] in image coordinates, partly outside the map unless inside
+    low, high = (0., 0.8) if inside else (-0.3, 1.2)
+    x = (torch.rand(n_rois, 2) * (high - low) + low) * (width - 1) / spatial_scale
+    y = (torch.rand(n_rois, 2) * (high - low) + low) * (height - 1) / spatial_scale
+    rois = torch.zeros(n_rois, 5)
+    rois[:,0] = (torch.rand(n_rois) * batch_size).floor()
+    rois[:,1] = x.min(1)[0].view(-1)
+    rois[:,2] = y.min(1)[0].view(-1)
+    rois[:,3] = x.max(1)[0].view(-1) + 1. / spatial_scale
+    rois[:,4] = y.max(1)[0].view(-1) + 1. / spatial_scale
+    return rois
+
+
+def align(impl, variant, size, spatial_scale, features, rois):
+    output = features.new(rois.size(0), features.size(1), size, size).zero_()
+    getattr(impl, 'roi_align_%sforward_%s' % (variant, 'cuda' if features.is_cuda else 'cpu'))(size, size, spatial_scale, features, rois, output)
+    return output
+
+
+def align_backward(impl, variant, size, spatial_scale, top_grad, rois, feature_size):
+    bottom_grad = top_grad.new(*feature_size).zero_()
+    getattr(impl, 'roi_align_%sbackward_%s' % (variant, 'cuda' if top_grad.is_cuda else 'cpu'))(size, size, spatial_scale, top_grad, rois, bottom_grad)
+    return bottom_grad
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-seed",default=0, type = int)
+    parser.add_argument("-tolerance",default=1e-4, type = float)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    size, spatial_scale = 3, 1. / 8
+    feature_size = (2, 4, 9, 11)
+    features = torch.randn(*feature_size)
+    failures = []
+
+    for variant, adjoint in VARIANTS:
+        name = 'roi_align_%s' % (variant)
+
+        ## no rois: nothing is aligned or scattered, and nothing raises
+        getattr(roi_align_cpu, 'roi_align_%sforward_cpu' % (variant))(size, size, spatial_scale, features, torch.FloatTensor(), torch.FloatTensor())
+        getattr(roi_align_cpu, 'roi_align_%sbackward_cpu' % (variant))(size, size, spatial_scale, torch.FloatTensor(), torch.FloatTensor(), features.new(*feature_size).zero_())
+
+        ## backward against forward: <backward(g), x> == <g, forward(x)> for a linear forward
+        if adjoint:
+            rois = random_rois(32, feature_size[0], feature_size[2], feature_size[3], spatial_scale, False)
+            top_grad = torch.randn(rois.size(0), feature_size[1], size, size)
+            lhs = (align(roi_align_cpu, variant, size, spatial_scale, features, rois) * top_grad).sum()
+            rhs = (align_backward(roi_align_cpu, variant, size, spatial_scale, top_grad, rois, feature_size) * features).sum()
+            error = abs(lhs - rhs) / max(abs(lhs), 1.)
+            print '{:<22} cpu backward vs forward   : {:.2e}'.format(name, error)
+            if error > args.tolerance:
+                failures.append(name + ' adjoint')
+
+        ## cpu against the cuda kernels, on rois inside the map (the cuda kernels read past the border)
+        if roi_align_cuda is None or not torch.cuda.is_available():
+            print '{:<22} cpu vs cuda               : skipped, no cuda'.format(name)
+            continue
+        rois = random_rois(32, feature_size[0], feature_size[2], feature_size[3], spatial_scale, True)
+        top_grad = torch.randn(rois.size(0), feature_size[1], size, size)
+        forward_error = (align(roi_align_cpu, variant, size, spatial_scale, features, rois) -
+                         align(roi_align_cuda, variant, size, spatial_scale, features.cuda(), rois.cuda()).cpu()).abs().max()
+        backward_error = (align_backward(roi_align_cpu, variant, size, spatial_scale, top_grad, rois, feature_size) -
+                          align_backward(roi_align_cuda, variant, size, spatial_scale, top_grad.cuda(), rois.cuda(), feature_size).cpu()).abs().max()
+        print '{:<22} cpu vs cuda forward/backward: {:.2e} / {:.2e}'.format(name, forward_error, backward_error)
+        if forward_error > args.tolerance or backward_error > args.tolerance:
+            failures.append(name + ' cuda parity')
+
+    if len(failures) > 0:
+        print 'failed: {}'.format(', '.join(failures))
+        sys.exit(1)
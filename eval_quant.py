@@ -0,0 +1,94 @@
+import os
+from os.path import join, isdir
+from Run import genConfig
+from tracker import *
+import numpy as np
+
+import argparse
+
+
+def head_latency(model, n_rows, repeat):
+    ## seconds per scoring call of n_rows roi features through fc4-fc6
+    feats = torch.randn(n_rows, 512 * 3 * 3)
+    with no_grad():
+        model.score(inference_variable(feats))
+        tic = time.time()
+        for _ in range(repeat):
+            model.score(inference_variable(feats))
+    return (time.time()-tic) / repeat
+
+
+def sequence_miou(iou_result):
+    valid = np.logical_not(np.isnan(iou_result))
+    return iou_result[valid].sum() / max(valid.sum(), 1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-set_type", default = 'OTB' )
+    parser.add_argument("-dataset_path", default = '/home/ilchae/dataset/tracking/')
+    parser.add_argument("-model_path", default = './models/rt-mdnet.pth')
+    parser.add_argument("-result_path", default = './quant_report.npy')
+    parser.add_argument("-seq", default=[], nargs='*')
+    parser.add_argument("-seed", default=0, type = int)
+    parser.add_argument("-n_threads",default=0, type = int)
+    parser.add_argument("-repeat",default=50, type = int)
+
+    args = parser.parse_args()
+
+    ##################################################################################
+    #########################Just modify opts in this script.#########################
+    ######################Becuase of synchronization of options#######################
+    ##################################################################################
+    opts['model_path']=args.model_path
+    opts['set_type']=args.set_type
+    opts['use_gpu'] = False
+    opts['n_threads'] = args.n_threads
+    opts['visual_log'] = False
+    ##################################################################################
+    ############################Do not modify opts anymore.###########################
+    ######################Becuase of synchronization of options#######################
+    ##################################################################################
+
+    if opts['use_gpu']:
+        raise RuntimeError("int8 scoring runs on cpu only, set opts['use_gpu'] = False")
+    if opts['n_threads'] > 0:
+        torch.set_num_threads(opts['n_threads'])
+
+    ## fc head latency, candidates scoring (n_samples) and hard negative mining (batch_neg_cand)
+    model = load_model()
+    latency = dict()
+    for n_rows in [opts['n_samples'], opts['batch_neg_cand']]:
+        fp32 = head_latency(model, n_rows, args.repeat)
+        model.quantize()
+        int8 = head_latency(model, n_rows, args.repeat)
+        model.dequantize()
+        latency[n_rows] = (fp32, int8)
+        print 'head {} rows : fp32 {:.2f} ms, int8 {:.2f} ms, speedup {:.2f}x'.format(n_rows, fp32*1000, int8*1000, fp32/int8)
+
+    ## tracking accuracy and speed, both modes start every sequence from the same seed
+    seq_home = args.dataset_path + opts['set_type']
+    seq_list = args.seq
+    if len(seq_list) == 0:
+        seq_list = sorted([f for f in os.listdir(seq_home) if isdir(join(seq_home,f))])
+
+    report = dict()
+    for mode in ['fp32', 'int8']:
+        opts['quantize_head'] = mode == 'int8'
+        report[mode] = dict()
+        for seq in seq_list:
+            img_list, gt = genConfig(seq_home + '/' + seq, opts['set_type'])
+            np.random.seed(args.seed)
+            torch.manual_seed(args.seed)
+            iou_result, result_bb, fps, result_nobb = run_mdnet(img_list, gt[0], gt, seq = seq)
+            report[mode][seq] = (sequence_miou(iou_result), fps)
+
+    print '{:<16} {:>10} {:>10} {:>10} {:>10}'.format('sequence', 'IoU fp32', 'IoU int8', 'fps fp32', 'fps int8')
+    for seq in seq_list:
+        print '{:<16} {:>10.3f} {:>10.3f} {:>10.2f} {:>10.2f}'.format(seq, report['fp32'][seq][0], report['int8'][seq][0],
+                                                                    report['fp32'][seq][1], report['int8'][seq][1])
+    mean = dict([(mode, np.mean(report[mode].values(), axis=0)) for mode in report])
+    print '{:<16} {:>10.3f} {:>10.3f} {:>10.2f} {:>10.2f}'.format('mean', mean['fp32'][0], mean['int8'][0], mean['fp32'][1], mean['int8'][1])
+
+    np.save(args.result_path, {'report': report, 'head_latency': latency})
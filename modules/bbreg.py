@@ -1,22 +1,46 @@
 import sys
-from sklearn.linear_model import Ridge
 import numpy as np
+import torch
 
 from utils import *
 
+
+def solve(A, B):
+    ## A^-1 B for a symmetric positive definite A, across torch versions
+    if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'solve'):
+        return torch.linalg.solve(A, B)
+    if hasattr(torch, 'solve'):
+        return torch.solve(B, A)[0]
+    return torch.gesv(B, A)[0]
+
+
 class BBRegressor():
-    def __init__(self, img_size, alpha=1000, overlap=[0.6, 1], scale=[1, 2]):
+    '''
+    Ridge regression (with intercept, as sklearn Ridge) from roi features to bbox offsets
+    Weights stay on the device of the features, predict is one matmul.
+    The system is solved in the dual form (n x n kernel) when there are fewer samples
+    than feature dimensions, in the primal form (d x d Gram matrix) otherwise.
+    update() appends new samples, keeping the last max_samples. The kernel grows by the new
+    rows only, the system (up to max_samples x max_samples) is solved again every refit_interval
+    updates, the weights of the last solve are used in between.
+    '''
+
+    def __init__(self, img_size, alpha=1000, overlap=[0.6, 1], scale=[1, 2], max_samples=2000, refit_interval=1):
         self.img_size = img_size
         self.alpha = alpha
         self.overlap_range = overlap
         self.scale_range = scale
-        self.model = Ridge(alpha=self.alpha)
+        self.max_samples = max_samples
+        self.refit_interval = refit_interval
+        self.n_updates = 0
+        self.X = None
+        self.coef = None
 
-    def train(self, X, bbox, gt):
-        X = X.cpu().numpy()
+    def select(self, X, bbox, gt):
+        ## samples in the overlap/scale range of gt and their regression targets
         bbox = np.copy(bbox)
         gt = np.copy(gt)
-        
+
         if gt.ndim==1:
             gt = gt[None,:]
 
@@ -25,36 +49,94 @@ class BBRegressor():
         idx = (r >= self.overlap_range[0]) * (r <= self.overlap_range[1]) * \
               (s >= self.scale_range[0]) * (s <= self.scale_range[1])
 
-        X = X[idx]
+        idx = np.where(idx)[0]
+        if len(idx) == 0:
+            return None, None
+        X = X.index_select(0, X.new(idx).long()).double()
         bbox = bbox[idx]
 
         Y = self.get_examples(bbox, gt)
-        
-        self.model.fit(X, Y)
+        return X, torch.from_numpy(Y).type_as(X)
+
+    def train(self, X, bbox, gt):
+        ## no sample in the overlap/scale range: predict passes the boxes through until update() finds some
+        self.X, self.Y = self.select(X, bbox, gt)
+        if self.X is None:
+            return
+        self.K = self.X.mm(self.X.t())
+        self.fit()
+
+    def update(self, X, bbox, gt):
+        ## add samples of a new frame, the kernel grows by the new rows only
+        X, Y = self.select(X, bbox, gt)
+        if X is None:
+            return
+        if self.X is None:
+            self.X, self.Y = X, Y
+            self.K = X.mm(X.t())
+            self.fit()
+            return
+        K_new = X.mm(self.X.t())
+        self.K = torch.cat((torch.cat((self.K, K_new.t()), 1),
+                            torch.cat((K_new, X.mm(X.t())), 1)), 0)
+        self.X = torch.cat((self.X, X), 0)
+        self.Y = torch.cat((self.Y, Y), 0)
+
+        n_drop = self.X.size(0) - self.max_samples
+        if n_drop > 0:
+            self.X = self.X[n_drop:]
+            self.Y = self.Y[n_drop:]
+            self.K = self.K[n_drop:, n_drop:]
+
+        self.n_updates += 1
+        if self.n_updates % self.refit_interval == 0:
+            self.fit()
+
+    def fit(self):
+        X, Y = self.X, self.Y
+        n, d = X.size(0), X.size(1)
+
+        x_mean = X.mean(0)
+        y_mean = Y.mean(0)
+        Yc = Y - y_mean.unsqueeze(0)
+
+        if n <= d:
+            # dual form on the centered kernel
+            k_mean = self.K.mean(0)
+            Kc = self.K - k_mean.unsqueeze(0) - k_mean.unsqueeze(1) + k_mean.mean()
+            dual = solve(Kc + self.alpha * torch.eye(n).type_as(Kc), Yc)
+            self.coef = (X - x_mean.unsqueeze(0)).t().mm(dual)
+        else:
+            Xc = X - x_mean.unsqueeze(0)
+            G = Xc.t().mm(Xc)
+            self.coef = solve(G + self.alpha * torch.eye(d).type_as(G), Xc.t().mm(Yc))
+        self.intercept = y_mean - x_mean.unsqueeze(0).mm(self.coef).squeeze(0)
 
     def predict(self, X, bbox):
-        X = X.cpu().numpy()
         bbox_ = np.copy(bbox)
+        if self.coef is None:
+            return bbox_
+
+        Y = X.double().mm(self.coef) + self.intercept.unsqueeze(0)
+        Y = Y.cpu().numpy()
 
-        Y = self.model.predict(X)
-    
         bbox_[:,:2] = bbox_[:,:2] + bbox_[:,2:]/2
         bbox_[:,:2] = Y[:,:2] * bbox_[:,2:] + bbox_[:,:2]
         bbox_[:,2:] = np.exp(Y[:,2:]) * bbox_[:,2:]
         bbox_[:,:2] = bbox_[:,:2] - bbox_[:,2:]/2
-        
+
         r = overlap_ratio(bbox, bbox_)
         s = np.prod(bbox[:,2:], axis=1) / np.prod(bbox_[:,2:], axis=1)
         idx = (r >= self.overlap_range[0]) * (r <= self.overlap_range[1]) * \
               (s >= self.scale_range[0]) * (s <= self.scale_range[1])
         idx = np.logical_not(idx)
         bbox_[idx] = bbox[idx]
- 
+
         bbox_[:,:2] = np.maximum(bbox_[:,:2], 0)
         bbox_[:,2:] = np.minimum(bbox_[:,2:], self.img_size - bbox[:,:2])
 
         return bbox_
-    
+
     def get_examples(self, bbox, gt):
         bbox[:,:2] = bbox[:,:2] + bbox[:,2:]/2
         gt[:,:2] = gt[:,:2] + gt[:,2:]/2
@@ -64,4 +146,3 @@ class BBRegressor():
 
         Y = np.concatenate((dst_xy, dst_wh), axis=1)
         return Y
-
@@ -70,6 +70,8 @@ class RegionDataset(data.Dataset):
         n_neg = self.batch_neg
 
         scenes = []
+        total_pos_rois = []
+        total_neg_rois = []
         for i, (img_path, bbox) in enumerate(zip(self.img_list[idx], self.gt[idx])):
             image = Image.open(img_path).convert('RGB')
             image = np.asarray(image)
@@ -100,24 +102,13 @@ class RegionDataset(data.Dataset):
 
             jittered_obj_size = jitter_scale[0][0]*float(pretrain_opts['img_size'])
 
-            batch_num = np.zeros((pos_examples.shape[0], 1))
-            pos_rois = np.copy(pos_examples)
-            pos_rois[:, 0:2] -= np.repeat(np.reshape(padded_scene_box[0:2], (1, 2)), pos_rois.shape[0], axis=0)
-            pos_rois = samples2maskroi(pos_rois, self.receptive_field, (jittered_obj_size, jittered_obj_size),bbox[2:4], pretrain_opts['padding'])
-            pos_rois = np.concatenate((batch_num, pos_rois), axis=1)
-
-            batch_num = np.zeros((neg_examples.shape[0], 1))
-            neg_rois = np.copy(neg_examples)
-            neg_rois[:, 0:2] -= np.repeat(np.reshape(padded_scene_box[0:2], (1, 2)), neg_rois.shape[0], axis=0)
-            neg_rois = samples2maskroi(neg_rois, self.receptive_field, (jittered_obj_size, jittered_obj_size),bbox[2:4], pretrain_opts['padding'])
-            neg_rois = np.concatenate((batch_num, neg_rois), axis=1)
-
-            if i==0:
-                total_pos_rois = [torch.from_numpy(np.copy(pos_rois).astype('float32'))]
-                total_neg_rois = [torch.from_numpy(np.copy(neg_rois).astype('float32'))]
-            else:
-                total_pos_rois.append(torch.from_numpy(np.copy(pos_rois).astype('float32')))
-                total_neg_rois.append(torch.from_numpy(np.copy(neg_rois).astype('float32')))
+            ## pos and neg rois of the frame in one array, the scene is the only one of its batch
+            rois, offsets = build_rois([(pos_examples, 0, padded_scene_box, jittered_obj_size, bbox[2:4]),
+                                        (neg_examples, 0, padded_scene_box, jittered_obj_size, bbox[2:4])],
+                                       self.receptive_field, pretrain_opts['padding'])
+            rois = torch.from_numpy(rois)
+            total_pos_rois.append(rois[int(offsets[0]):int(offsets[1])])
+            total_neg_rois.append(rois[int(offsets[1]):int(offsets[2])])
 
         return scenes,total_pos_rois, total_neg_rois
 
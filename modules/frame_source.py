@@ -0,0 +1,304 @@
+import os
+import time
+import threading
+import subprocess
+import Queue
+
+import numpy as np
+from PIL import Image
+
+try:
+    import av
+except ImportError:
+    av = None
+
+VIDEO_EXTS = ['.mp4', '.avi', '.mkv', '.mov', '.h264', '.264']
+
+
+def load_image(img_path):
+    cur_image = Image.open(img_path).convert('RGB')
+    return np.asarray(cur_image)
+
+
+class FramePrefetcher():
+    '''
+    Decode the frames of an image list ahead of the tracking loop
+    - n_prefetch: frames decoded ahead at most (bounds the memory)
+    - n_workers: decoding threads, PIL releases the GIL while decoding
+    Frames are returned in order. stall_time holds the seconds the consumer
+    waited for each frame, i.e. the decode time the prefetch did not hide.
+    '''
+
+    def __init__(self, img_list, n_prefetch=8, n_workers=2, loader=load_image):
+        self.img_list = list(img_list)
+        self.loader = loader
+        self.n_prefetch = max(n_prefetch, 1)
+        self.pointer = 0
+        self.stall_time = []
+
+        self.tasks = Queue.Queue()
+        for idx in range(len(self.img_list)):
+            self.tasks.put(idx)
+        self.slots = threading.Semaphore(self.n_prefetch)
+        self.ready = threading.Condition()
+        self.frames = dict()
+        self.closed = False
+
+        self.workers = []
+        for _ in range(max(n_workers, 1)):
+            worker = threading.Thread(target=self.decode_loop)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def decode_loop(self):
+        while not self.closed:
+            ## a slot is taken before the index, so frames are decoded in order
+            self.slots.acquire()
+            if self.closed:
+                return
+            try:
+                idx = self.tasks.get_nowait()
+            except Queue.Empty:
+                self.slots.release()
+                return
+            try:
+                frame = (self.loader(self.img_list[idx]), None)
+            except Exception as e:
+                frame = (None, e)
+            with self.ready:
+                self.frames[idx] = frame
+                self.ready.notify_all()
+
+    def __len__(self):
+        return len(self.img_list)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pointer >= len(self.img_list):
+            self.close()
+            raise StopIteration
+
+        tic = time.time()
+        with self.ready:
+            while self.pointer not in self.frames:
+                self.ready.wait()
+            frame, error = self.frames.pop(self.pointer)
+        self.stall_time.append(time.time()-tic)
+        self.slots.release()
+
+        if error is not None:
+            self.close()
+            raise error
+        self.pointer += 1
+        return frame
+
+    next = __next__
+
+    def close(self):
+        ## stop the workers, frames being decoded are dropped
+        self.closed = True
+        for _ in self.workers:
+            self.slots.release()
+
+    def total_stall(self):
+        return float(np.sum(self.stall_time))
+
+
+def find_video(seq_path):
+    ## video file of a sequence directory, None if the sequence is given as images
+    if not os.path.isdir(seq_path):
+        return None
+    videos = sorted([p for p in os.listdir(seq_path) if os.path.splitext(p)[1].lower() in VIDEO_EXTS])
+    if len(videos) == 0:
+        return None
+    return os.path.join(seq_path, videos[0])
+
+
+def count_frames(video_path):
+    ## number of frames of the first video stream by demuxing it (no decoding), for containers without a frame count
+    if av is not None:
+        container = av.open(video_path)
+        stream = container.streams.video[0]
+        ## the flushing packets at the end carry no data
+        n_frames = sum([1 for packet in container.demux(stream) if packet.size > 0])
+        container.close()
+        return n_frames
+
+    info = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+                                    '-show_entries', 'stream=nb_read_packets', '-of', 'default=noprint_wrappers=1:nokey=1', video_path])
+    info = info.strip()
+    return int(info) if info.isdigit() else 0
+
+
+def probe_video(video_path):
+    ## (fps, width, height, number of frames) of the first video stream, 0 frames if unknown
+    if av is not None:
+        container = av.open(video_path)
+        stream = container.streams.video[0]
+        fps = float(stream.average_rate)
+        n_frames = stream.frames
+        if n_frames == 0 and stream.duration is not None:
+            n_frames = int(round(float(stream.duration * stream.time_base) * fps))
+        width, height = stream.codec_context.width, stream.codec_context.height
+        container.close()
+        return fps, width, height, n_frames
+
+    info = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                                    '-show_entries', 'stream=width,height,avg_frame_rate,nb_frames,duration',
+                                    '-of', 'default=noprint_wrappers=1', video_path])
+    info = dict([line.split('=', 1) for line in info.splitlines() if '=' in line])
+    num, den = info['avg_frame_rate'].split('/')
+    fps = float(num) / float(den)
+    if info.get('nb_frames', 'N/A').isdigit():
+        n_frames = int(info['nb_frames'])
+    elif info.get('duration', 'N/A') != 'N/A':
+        n_frames = int(round(float(info['duration']) * fps))
+    else:
+        n_frames = 0
+    return fps, int(info['width']), int(info['height']), n_frames
+
+
+class VideoFrameSource():
+    '''
+    Stream the RGB frames [start, stop) of a video file, without extracting images
+    Decoding runs in a background thread with PyAV when it is installed, or with an
+    ffmpeg subprocess otherwise. start is reached by seeking, not by decoding from the
+    first frame. Same interface as FramePrefetcher: len(), next(), close(), stall_time.
+    len() is the frame count of the container (counted by demuxing when the container has
+    none), which may be an estimate: with stop=None the video is decoded to its end, and
+    next() raises StopIteration when the stream ends before len() frames.
+    '''
+
+    def __init__(self, video_path, start=0, stop=None, n_prefetch=8):
+        self.video_path = video_path
+        self.fps, self.width, self.height, n_frames = probe_video(video_path)
+        if n_frames == 0:
+            n_frames = count_frames(video_path)
+        ## decode_stop bounds the decoding, None decodes to the end of the stream
+        self.decode_stop = stop
+        if stop is None or stop > n_frames:
+            stop = n_frames
+        self.start = start
+        self.stop = stop
+        self.n_prefetch = max(n_prefetch, 1)
+        self.pointer = 0
+        self.stall_time = []
+        self.queue = None
+        self.closed = False
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.queue is None:
+            ## decoding starts with the first request, not when the sequence is configured
+            self.queue = Queue.Queue(self.n_prefetch)
+            worker = threading.Thread(target=self.decode_loop)
+            worker.daemon = True
+            worker.start()
+
+        if self.pointer >= len(self):
+            self.close()
+            raise StopIteration
+
+        tic = time.time()
+        frame = self.queue.get()
+        self.stall_time.append(time.time()-tic)
+
+        if isinstance(frame, Exception):
+            self.close()
+            raise frame
+        if frame is None:
+            self.close()
+            if self.pointer == 0:
+                raise RuntimeError("no frame decoded from %s (from frame %d)" % (self.video_path, self.start))
+            raise StopIteration
+        self.pointer += 1
+        return frame
+
+    next = __next__
+
+    def put(self, item):
+        ## blocks while the queue is full, gives up when the source is closed
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def decode_loop(self):
+        try:
+            if av is not None:
+                frames = self.decode_pyav()
+            else:
+                frames = self.decode_ffmpeg()
+            for frame in frames:
+                if not self.put(frame):
+                    return
+            self.put(None)
+        except Exception as e:
+            self.put(e)
+
+    def decode_pyav(self):
+        container = av.open(self.video_path)
+        try:
+            stream = container.streams.video[0]
+            time_base = float(stream.time_base)
+            start_time = stream.start_time if stream.start_time is not None else 0
+            if self.start > 0:
+                ## seeks to the keyframe before start, the frames up to start are dropped below
+                container.seek(start_time + int(self.start / self.fps / time_base), backward=True, any_frame=False, stream=stream)
+            for frame in container.decode(stream):
+                if frame.pts is not None:
+                    idx = int(round((frame.pts - start_time) * time_base * self.fps))
+                    if idx < self.start:
+                        continue
+                    if self.decode_stop is not None and idx >= self.decode_stop:
+                        break
+                yield frame.to_ndarray(format='rgb24')
+        finally:
+            container.close()
+
+    def decode_ffmpeg(self):
+        cmd = ['ffmpeg', '-v', 'error']
+        if self.start > 0:
+            ## -ss before -i seeks in the container, then decodes accurately up to start
+            cmd += ['-ss', '%.6f' % (self.start / self.fps)]
+        cmd += ['-i', self.video_path]
+        if self.decode_stop is not None:
+            cmd += ['-frames:v', str(max(self.decode_stop - self.start, 0))]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=10**8)
+        frame_size = self.width * self.height * 3
+        try:
+            while True:
+                buf = proc.stdout.read(frame_size)
+                if len(buf) < frame_size:
+                    break
+                yield np.frombuffer(buf, dtype='uint8').reshape(self.height, self.width, 3)
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+    def close(self):
+        self.closed = True
+
+    def total_stall(self):
+        return float(np.sum(self.stall_time))
+
+
+def open_frames(img_list, n_prefetch=8, n_workers=2):
+    ## frame source of a sequence given as image paths or as a VideoFrameSource
+    if isinstance(img_list, VideoFrameSource):
+        return img_list
+    return FramePrefetcher(img_list, n_prefetch, n_workers)
@@ -18,10 +18,35 @@ class imgCropper(nn.Module):
         self.isCuda = False
         self.img_size = img_size
         self.roi_align_model = RoIAlign(img_size,img_size, 1. )
+        ## the last frame given to crop_image and its converted, uploaded copy
+        self.cached_frame = None
+        self.cached_image_var = None
 
     def gpuEnable(self):
         self.roi_align_model = self.roi_align_model.cuda()
         self.isCuda = True
+        self.invalidate()
+
+    def image_var(self, image):
+        ## 1 x 3 x H x W float Variable of the frame on the device. The conversion and the upload are done
+        ## once for all the crops of a frame: the frame is recognized by identity (the array object), so a
+        ## caller refilling the same array with a new frame has to call invalidate() first.
+        if image is not self.cached_frame:
+            ishape = image.shape
+            cur_image_var = np.reshape(image, (1, ishape[0], ishape[1], ishape[2]))
+            cur_image_var = cur_image_var.transpose(0, 3, 1, 2)
+            cur_image_var = cur_image_var.astype('float32')
+            cur_image_var = Variable(torch.from_numpy(cur_image_var).float())
+            if self.isCuda:
+                cur_image_var = cur_image_var.cuda()
+            self.cached_frame = image
+            self.cached_image_var = cur_image_var
+        return self.cached_image_var
+
+    def invalidate(self):
+        ## drop the cached frame, the next crop_image converts and uploads its frame again
+        self.cached_frame = None
+        self.cached_image_var = None
 
     def forward(self, image, roi):
         aligned_image_var = self.roi_align_model(image, roi)
@@ -29,12 +54,7 @@ class imgCropper(nn.Module):
 
     def crop_image(self,image, box, result_size):
         ## constraint = several box from common 1 image
-        ishape = image.shape
-        cur_image_var = np.reshape(image, (1, ishape[0], ishape[1], ishape[2]))
-        cur_image_var = cur_image_var.transpose(0, 3, 1, 2)
-        cur_image_var = cur_image_var.astype('float32')
-        cur_image_var = Variable(torch.from_numpy(cur_image_var).float())
-
+        cur_image_var = self.image_var(image)
 
         roi = np.copy(box)
         roi[:,2:4] += roi[:,0:2]
@@ -42,7 +62,6 @@ class imgCropper(nn.Module):
         roi = Variable(torch.from_numpy(roi).float())
 
         if self.isCuda:
-            cur_image_var = cur_image_var.cuda()
             roi = roi.cuda()
 
         self.roi_align_model.aligned_width = result_size[0]
@@ -57,10 +76,12 @@ class imgCropper(nn.Module):
         assert(len(target_list) == len(img_list))
 
         ## image crop
-        torch.cuda.synchronize()
+        if self.isCuda:
+            torch.cuda.synchronize()
         start_time = time.time()
         cur_images = torch.squeeze(torch.stack(img_list, 0))
-        torch.cuda.synchronize()
+        if self.isCuda:
+            torch.cuda.synchronize()
         print '10 image stacking time:{}'.format(time.time() - start_time)
 
         ishape = cur_images.size()
@@ -1,4 +1,5 @@
 import os
+import copy
 import scipy.io
 import numpy as np
 from collections import OrderedDict
@@ -14,6 +15,31 @@ import sys
 sys.path.insert(0,'./roi_align')
 from roi_align.modules.roi_align import RoIAlignAvg,RoIAlignMax
 
+## inference without autograd on torch 0.3 (volatile Variables) and on later versions (torch.no_grad)
+if hasattr(torch, 'no_grad'):
+    no_grad = torch.no_grad
+
+    def inference_variable(x):
+        return x
+else:
+    class no_grad():
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+    def inference_variable(x):
+        return Variable(x, volatile=True)
+
+
+def skip_dropout(module, x):
+    for child in module.children():
+        if not isinstance(child, nn.Dropout):
+            x = child(x)
+    return x
+
+
 def append_params(params, module, prefix):
     for child in module.children():
         for k,p in child._parameters.iteritems():
@@ -57,6 +83,32 @@ class LRN(nn.Module):
         return x
 
 
+class TrunkGraph(nn.Module):
+    ## conv1-conv3 with the weights as inputs, scripted by MDNet.compile
+    def __init__(self, lrn_size, lrn_alpha, lrn_beta):
+        super(TrunkGraph, self).__init__()
+        self.lrn_size = lrn_size
+        self.lrn_alpha = lrn_alpha
+        self.lrn_beta = lrn_beta
+
+    def lrn(self, x):
+        div = F.avg_pool2d(x.pow(2), self.lrn_size, 1, (self.lrn_size - 1) // 2)
+        return x.div(div.mul(self.lrn_alpha).add(2.0).pow(self.lrn_beta))
+
+    def forward(self, x, w1, b1, w2, b2, w3, b3):
+        x = F.max_pool2d(self.lrn(F.relu(F.conv2d(x, w1, b1, 2))), 3, 2)
+        x = self.lrn(F.relu(F.conv2d(x, w2, b2, 2)))
+        return F.relu(F.conv2d(x, w3, b3, 1, 0, 3))
+
+
+class HeadGraph(nn.Module):
+    ## fc4-fc6 in eval mode (no dropout) with the weights as inputs, scripted by MDNet.compile
+    def forward(self, x, w4, b4, w5, b5, w6, b6):
+        x = F.relu(F.linear(x, w4, b4))
+        x = F.relu(F.linear(x, w5, b5))
+        return F.linear(x, w6, b6)
+
+
 class MDNet(nn.Module):
     def __init__(self, model_path=None,K=1):
         super(MDNet, self).__init__()
@@ -98,6 +150,11 @@ class MDNet(nn.Module):
                 raise RuntimeError("Unkown model format: %s" % (model_path))
         self.build_param_dict()
 
+        ## int8 copy of the fc layers used by score() on cpu, see quantize()
+        self.__dict__['qhead'] = None
+        ## scripted conv1-conv3 and fc4-fc6 graphs, see compile()
+        self.__dict__['graphs'] = None
+
     def build_param_dict(self):
         self.params = OrderedDict()
         for name, module in self.layers.named_children():
@@ -105,6 +162,24 @@ class MDNet(nn.Module):
         for k, module in enumerate(self.branches):
             append_params(self.params, module, 'fc6_%d'%(k))
 
+    def clone(self, shared_layers=[]):
+        ## copy of the network, modules in shared_layers (names in self.layers) are shared, not copied
+        memo = {}
+        if self.graphs is not None:
+            memo[id(self.graphs)] = self.graphs
+        for name, module in self.layers.named_children():
+            if name in shared_layers:
+                memo[id(module)] = module
+                for p in module.parameters():
+                    memo[id(p)] = p
+        model = copy.deepcopy(self, memo)
+        for branch in model.branches:
+            for module in branch.modules():
+                if isinstance(module, nn.Linear):
+                    module.reset_parameters()
+        model.build_param_dict()
+        return model
+
     def set_learnable_params(self, layers):
         for k, p in self.params.iteritems():
             if any([k.startswith(l) for l in layers]):
@@ -121,6 +196,8 @@ class MDNet(nn.Module):
         return params
 
     def forward(self, x, k=0, in_layer='conv1', out_layer='fc6'):
+        if self.graphs is not None and in_layer == 'conv1' and out_layer == 'conv3':
+            return self.graphs['trunk'](x, *self.graph_weights(['conv1', 'conv2', 'conv3']))
 
         run = False
         for name, module in self.layers.named_children():
@@ -138,8 +215,96 @@ class MDNet(nn.Module):
         elif out_layer=='fc6_softmax':
             return F.softmax(x)
 
+    def score(self, x, k=0, in_layer='fc4', out_layer='fc6', quantized=True):
+        ## output without dropout, as in eval mode, whatever the current mode.
+        ## the fc layers run with int8 weights once quantize() has been called, unless quantized is False
+        qhead = self.qhead
+        if qhead is not None and (not quantized or k != qhead.branch or x.is_cuda):
+            qhead = None
+        if qhead is None and self.graphs is not None and in_layer == 'fc4' and out_layer == 'fc6':
+            return self.graphs['head'](x, *(self.graph_weights(['fc4', 'fc5']) + self.graph_weights([], k)))
+
+        run = False
+        for name, module in self.layers.named_children():
+            if name == in_layer:
+                run = True
+            if run:
+                if qhead is not None and name in qhead.layers:
+                    module = qhead.layers[name]
+                x = skip_dropout(module, x)
+                if name == out_layer:
+                    return x
+        if qhead is not None:
+            return skip_dropout(qhead.layers['fc6'], x)
+        return skip_dropout(self.branches[k], x)
+
+    def graph_weights(self, layers, k=None):
+        ## weight and bias of the conv / linear module of each layer (of branch k), inputs of the scripted graphs
+        modules = [getattr(self.layers, name) for name in layers]
+        if k is not None:
+            modules.append(self.branches[k])
+        weights = []
+        for module in modules:
+            for child in module.children():
+                if isinstance(child, (nn.Conv2d, nn.Linear)):
+                    weights += [child.weight, child.bias]
+        return weights
+
+    def compile(self, cache_dir):
+        ## script the conv1-conv3 and fc4-fc6 graphs, compiled graphs are saved in cache_dir and loaded from there
+        if not hasattr(torch, 'jit') or not hasattr(torch.jit, 'script') or not hasattr(torch.jit, 'save'):
+            raise RuntimeError("compiled graphs need torch.jit.script (torch >= 1.2)")
+        lrn = self.layers.conv1[2]
+        if lrn.ACROSS_CHANNELS or self.layers.conv2[2].ACROSS_CHANNELS:
+            raise RuntimeError("compiled graphs support LRN within channels only")
+        lrn_size = lrn.average.kernel_size
+        if isinstance(lrn_size, tuple):
+            lrn_size = lrn_size[0]
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        graphs = OrderedDict()
+        for name, graph in [('trunk', TrunkGraph(lrn_size, lrn.alpha, lrn.beta)), ('head', HeadGraph())]:
+            ## the graphs take the weights as inputs, so the artifacts only depend on the graph and the torch version
+            if name == 'trunk':
+                name_ = 'trunk_%d_%g_%g' % (lrn_size, lrn.alpha, lrn.beta)
+            else:
+                name_ = name
+            path = os.path.join(cache_dir, 'mdnet_%s_torch%s.pt' % (name_, torch.__version__))
+            if os.path.exists(path):
+                graphs[name] = torch.jit.load(path)
+            else:
+                graphs[name] = torch.jit.script(graph)
+                ## written aside and renamed, several workers may compile at once
+                tmp_path = '%s.%d.tmp' % (path, os.getpid())
+                torch.jit.save(graphs[name], tmp_path)
+                os.rename(tmp_path, path)
+        self.__dict__['graphs'] = graphs
+
+    def quantize(self, k=0):
+        ## int8 scoring (dynamic quantization of the fc layers of branch k) on cpu, training keeps the fp32 weights
+        if not hasattr(torch, 'quantization') or not hasattr(torch.quantization, 'quantize_dynamic'):
+            raise RuntimeError("int8 scoring needs torch.quantization.quantize_dynamic (torch >= 1.3)")
+        if any([p.is_cuda for p in self.parameters()]):
+            raise RuntimeError("int8 scoring runs on cpu only")
+        self.__dict__['qhead'] = QuantizedHead(k)
+        self.requantize()
+
+    def dequantize(self):
+        self.__dict__['qhead'] = None
+
+    def requantize(self):
+        ## refresh the int8 weights from the fp32 ones, after an update
+        if self.qhead is None:
+            return
+        head = OrderedDict([(name, copy.deepcopy(module)) for name, module in self.layers.named_children() if name.startswith('fc')])
+        head['fc6'] = copy.deepcopy(self.branches[self.qhead.branch])
+        head = nn.Sequential(head).eval()
+        head = torch.quantization.quantize_dynamic(head, {nn.Linear}, dtype=torch.qint8)
+        self.qhead.layers = OrderedDict(head.named_children())
+
     def load_model(self, model_path):
-        states = torch.load(model_path)
+        states = torch.load(model_path, map_location=lambda storage, loc: storage)
         shared_layers = states['shared_layers']
         self.layers.load_state_dict(shared_layers)
 
@@ -158,6 +323,12 @@ class MDNet(nn.Module):
         return
 
 
+class QuantizedHead():
+    def __init__(self, branch):
+        self.branch = branch
+        self.layers = OrderedDict()
+
+
 class BinaryLoss(nn.Module):
     def __init__(self):
         super(BinaryLoss, self).__init__()
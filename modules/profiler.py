@@ -0,0 +1,108 @@
+import time
+import numpy as np
+from collections import OrderedDict
+
+import torch
+
+
+class Stage():
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        if self.timer.enabled:
+            self.timer.synchronize()
+            self.tic = time.time()
+        return self
+
+    def __exit__(self, *args):
+        if self.timer.enabled:
+            self.timer.synchronize()
+            self.timer.add(self.name, time.time()-self.tic)
+        return False
+
+
+class StageTimer():
+    '''
+    Wall time of the tracking stages, frame by frame
+        stage_timer.reset(enabled=True, sync=opts['use_gpu'])
+        stage_timer.new_frame()
+        with stage('conv'):
+            ...
+    The device is synchronized before and after every stage when sync is set, so that
+    asynchronous cuda kernels are charged to the stage that launched them.
+    Stages may nest (e.g. 'collect' contains its own 'crop', 'conv' and 'roi_align'),
+    a stage entered several times in one frame is summed.
+    Nothing is measured (and nothing synchronized) while disabled.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.sync = False
+        self.frames = []
+
+    def reset(self, enabled=False, sync=False):
+        self.enabled = enabled
+        self.sync = sync and torch.cuda.is_available()
+        self.frames = []
+
+    def synchronize(self):
+        if self.sync:
+            torch.cuda.synchronize()
+
+    def new_frame(self):
+        if self.enabled:
+            self.frames.append(OrderedDict())
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def add(self, name, seconds):
+        if len(self.frames) == 0:
+            self.new_frame()
+        frame = self.frames[-1]
+        frame[name] = frame.get(name, 0.) + seconds
+
+    def names(self):
+        names = []
+        for frame in self.frames:
+            names += [name for name in frame if name not in names]
+        return names
+
+    def table(self):
+        ## n_frames x n_stages seconds, nan where a stage did not run in a frame
+        names = self.names()
+        times = np.full((len(self.frames), len(names)), np.nan)
+        for i, frame in enumerate(self.frames):
+            for j, name in enumerate(names):
+                times[i,j] = frame.get(name, np.nan)
+        return names, times
+
+    def summary(self, skip_first=True):
+        ## stage -> (mean, p50, p95, p99) seconds over the frames the stage ran in
+        ## the first frame (initial training) is left out by default
+        names, times = self.table()
+        if skip_first:
+            times = times[1:]
+        summary = OrderedDict()
+        for j, name in enumerate(names):
+            t = times[np.logical_not(np.isnan(times[:,j])), j]
+            if len(t) == 0:
+                continue
+            summary[name] = (t.mean(), np.percentile(t, 50), np.percentile(t, 95), np.percentile(t, 99))
+        return summary
+
+    def report(self, skip_first=True):
+        lines = ['{:<12} {:>9} {:>9} {:>9} {:>9}'.format('stage (ms)', 'mean', 'p50', 'p95', 'p99')]
+        for name, stats in self.summary(skip_first).iteritems():
+            lines.append('{:<12} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(name, *[s*1000 for s in stats]))
+        return '\n'.join(lines)
+
+
+## one timer per process, the tracking code reports to it through stage()
+stage_timer = StageTimer()
+
+
+def stage(name):
+    return stage_timer.stage(name)
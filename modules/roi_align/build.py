@@ -19,7 +19,9 @@ if torch.cuda.is_available():
 
 this_file = os.path.dirname(os.path.realpath(__file__))
 print(this_file)
-extra_objects = ['src/cuda/roi_align.cu.o']
+extra_objects = []
+if with_cuda:
+    extra_objects += ['src/cuda/roi_align.cu.o']
 extra_objects = [os.path.join(this_file, fname) for fname in extra_objects]
 
 ffi = create_extension(
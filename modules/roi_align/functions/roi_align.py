@@ -1,6 +1,11 @@
 import torch
 from torch.autograd import Function
-from .._ext import roi_align
+from . import roi_align_cpu
+try:
+    from .._ext import roi_align
+except ImportError:
+    # cpu-only installs do not build the cuda extension
+    roi_align = None
 
 
 # TODO use save_for_backward instead
@@ -26,21 +31,30 @@ class RoIAlignFunction(Function):
                                              self.spatial_scale, features,
                                              rois, output)
         else:
-            raise NotImplementedError
+            success = roi_align_cpu.roi_align_forward_cpu(self.aligned_height,
+                                             self.aligned_width,
+                                             self.spatial_scale, features,
+                                             rois, output)
 
         return output
 
     def backward(self, grad_output):
-        assert(self.feature_size is not None and grad_output.is_cuda)
+        assert(self.feature_size is not None)
 
         batch_size, num_channels, data_height, data_width = self.feature_size
 
         grad_input = self.rois.new(batch_size, num_channels, data_height,
                                   data_width).zero_()
-        roi_align.roi_align_backward_cuda(self.aligned_height,
-                                          self.aligned_width,
-                                          self.spatial_scale, grad_output,
-                                          self.rois, grad_input)
+        if grad_output.is_cuda:
+            roi_align.roi_align_backward_cuda(self.aligned_height,
+                                              self.aligned_width,
+                                              self.spatial_scale, grad_output,
+                                              self.rois, grad_input)
+        else:
+            roi_align_cpu.roi_align_backward_cpu(self.aligned_height,
+                                             self.aligned_width,
+                                             self.spatial_scale, grad_output,
+                                             self.rois, grad_input)
 
         # print grad_input
 
@@ -70,21 +84,30 @@ class RoIAlignAdaFunction(Function):
                                              self.spatial_scale, features,
                                              rois, output)
         else:
-            raise NotImplementedError
+            success = roi_align_cpu.roi_align_ada_forward_cpu(self.aligned_height,
+                                             self.aligned_width,
+                                             self.spatial_scale, features,
+                                             rois, output)
 
         return output
 
     def backward(self, grad_output):
-        assert(self.feature_size is not None and grad_output.is_cuda)
+        assert(self.feature_size is not None)
 
         batch_size, num_channels, data_height, data_width = self.feature_size
 
         grad_input = self.rois.new(batch_size, num_channels, data_height,
                                   data_width).zero_()
-        roi_align.roi_align_ada_backward_cuda(self.aligned_height,
-                                          self.aligned_width,
-                                          self.spatial_scale, grad_output,
-                                          self.rois, grad_input)
+        if grad_output.is_cuda:
+            roi_align.roi_align_ada_backward_cuda(self.aligned_height,
+                                              self.aligned_width,
+                                              self.spatial_scale, grad_output,
+                                              self.rois, grad_input)
+        else:
+            roi_align_cpu.roi_align_ada_backward_cpu(self.aligned_height,
+                                             self.aligned_width,
+                                             self.spatial_scale, grad_output,
+                                             self.rois, grad_input)
 
         # print grad_input
 
@@ -114,21 +137,30 @@ class RoIAlignDenseAdaFunction(Function):
                                              self.spatial_scale, features,
                                              rois, output)
         else:
-            raise NotImplementedError
+            success = roi_align_cpu.roi_align_dense_ada_forward_cpu(self.aligned_height,
+                                             self.aligned_width,
+                                             self.spatial_scale, features,
+                                             rois, output)
 
         return output
 
     def backward(self, grad_output):
-        assert(self.feature_size is not None and grad_output.is_cuda)
+        assert(self.feature_size is not None)
 
         batch_size, num_channels, data_height, data_width = self.feature_size
 
         grad_input = self.rois.new(batch_size, num_channels, data_height,
                                   data_width).zero_()
-        roi_align.roi_align_dense_ada_backward_cuda(self.aligned_height,
-                                          self.aligned_width,
-                                          self.spatial_scale, grad_output,
-                                          self.rois, grad_input)
+        if grad_output.is_cuda:
+            roi_align.roi_align_dense_ada_backward_cuda(self.aligned_height,
+                                              self.aligned_width,
+                                              self.spatial_scale, grad_output,
+                                              self.rois, grad_input)
+        else:
+            roi_align_cpu.roi_align_dense_ada_backward_cpu(self.aligned_height,
+                                             self.aligned_width,
+                                             self.spatial_scale, grad_output,
+                                             self.rois, grad_input)
 
         # print grad_input
 
@@ -0,0 +1,227 @@
+import torch
+
+
+##################################################################################
+# CPU counterparts of the kernels in src/cuda/roi_align_kernel.cu.
+# Same signatures as the _ext.roi_align entry points (output tensors are filled in place).
+# Every aligned point is sampled from a few feature map locations ("taps").
+# The tap positions/weights are separable in (h, w), so each variant is described
+# per axis and all rois are interpolated at once with index_select / index_add_.
+##################################################################################
+
+def _no_rois(rois):
+    # nothing to align or to scatter: the outputs stay as allocated (empty / zero), as with the cuda kernels
+    return rois.dim() == 0 or rois.numel() == 0
+
+
+def _roi_grid(aligned_height, aligned_width, spatial_scale, rois, adaptive):
+    rois = rois.float()
+    roi_batch_ind = rois[:, 0].long()
+    roi_start_w = rois[:, 1] * spatial_scale
+    roi_start_h = rois[:, 2] * spatial_scale
+    roi_end_w = rois[:, 3] * spatial_scale
+    roi_end_h = rois[:, 4] * spatial_scale
+
+    # Force malformed ROIs to be 1x1
+    roi_width = (roi_end_w - roi_start_w + 1.).clamp(min=0.)
+    roi_height = (roi_end_h - roi_start_h + 1.).clamp(min=0.)
+
+    if adaptive:
+        bin_size_h = roi_height / float(aligned_height)
+        bin_size_w = roi_width / float(aligned_width)
+    else:
+        bin_size_h = roi_height / (aligned_height - 1.)
+        bin_size_w = roi_width / (aligned_width - 1.)
+
+    ph = torch.arange(0, aligned_height).type_as(rois).unsqueeze(0)
+    pw = torch.arange(0, aligned_width).type_as(rois).unsqueeze(0)
+
+    # (num_rois, aligned_height), (num_rois, aligned_width)
+    h = ph * bin_size_h.unsqueeze(1) + roi_start_h.unsqueeze(1)
+    w = pw * bin_size_w.unsqueeze(1) + roi_start_w.unsqueeze(1)
+
+    return roi_batch_ind, h, w, bin_size_h, bin_size_w
+
+
+def _inside(idx, size):
+    return (idx >= 0).float() * (idx < size).float()
+
+
+def _start(coord, size):
+    return coord.floor().clamp(max=size - 2)
+
+
+def _stride(bin_size):
+    # round() of the kernels, bin sizes are never negative
+    return (bin_size + 0.5).floor().clamp(min=1.).unsqueeze(1)
+
+
+def _bilinear_taps(coord, size):
+    start = _start(coord, size)
+    ratio = coord - start
+    valid = _inside(coord, size)
+    return [(start.long(), (1. - ratio) * valid), (start.long() + 1, ratio * valid)]
+
+
+def _adaptive_taps(coord, bin_size, size):
+    start = _start(coord, size)
+    stride = _stride(bin_size)
+    valid = _inside(coord, size)
+
+    taps = []
+    for offset in (0., 1.):
+        idx = start + offset * stride
+        ratio = 1. - (coord - idx).abs() / stride
+        taps.append((idx.long(), ratio * valid * _inside(idx, size)))
+    return taps
+
+
+def _dense_adaptive_taps(coord, bin_size, size):
+    start = _start(coord, size)
+    stride = _stride(bin_size)
+    valid = _inside(coord, size)
+
+    # every offset from 0 to stride, per roi. taps falling outside the feature map are dropped
+    # (the cuda kernel reads past the border there) and do not count in the normalization.
+    taps = []
+    for offset in range(int(stride.max()) + 1):
+        idx = start + offset
+        ratio = 1. - (coord - idx).abs() / stride
+        ratio = ratio * (stride >= offset).float()
+        taps.append((idx.long(), ratio * valid * _inside(idx, size)))
+    return taps
+
+
+def _dense_adaptive_grad_taps(coord, bin_size, size):
+    start = _start(coord, size)
+    stride = _stride(bin_size)
+    valid = _inside(coord, size)
+
+    # gaussian weights of the cuda backward kernel, 1/2.505 is applied once in _scatter
+    taps = []
+    for offset in (0., 1.):
+        idx = start + offset * stride
+        ratio = torch.exp(-0.5 * ((coord - idx) / stride).pow(2)) / (stride + 1.)
+        taps.append((idx.long(), ratio * valid * _inside(idx, size)))
+    return taps
+
+
+def _locations(roi_batch_ind, idx_h, idx_w, height, width):
+    img_start = (roi_batch_ind * height * width).view(-1, 1, 1)
+    loc = img_start + idx_h.clamp(0, height - 1).unsqueeze(2) * width + idx_w.clamp(0, width - 1).unsqueeze(1)
+    return loc.view(-1)
+
+
+def _ratio(ratio_h, ratio_w):
+    return (ratio_h.unsqueeze(2) * ratio_w.unsqueeze(1)).view(-1, 1)
+
+
+def _interpolate(features, roi_batch_ind, taps_h, taps_w):
+    batch_size, num_channels, height, width = features.size()
+
+    # (batch*height*width, channels) so that one row holds every channel of a location
+    bottom_data = features.permute(0, 2, 3, 1).contiguous().view(-1, num_channels)
+
+    top_data = None
+    for idx_h, ratio_h in taps_h:
+        for idx_w, ratio_w in taps_w:
+            cur_data = bottom_data.index_select(0, _locations(roi_batch_ind, idx_h, idx_w, height, width))
+            cur_data.mul_(_ratio(ratio_h, ratio_w))
+            if top_data is None:
+                top_data = cur_data
+            else:
+                top_data.add_(cur_data)
+    return top_data
+
+
+def _scatter(grad_output, roi_batch_ind, taps_h, taps_w, grad_input, scale=1.):
+    batch_size, num_channels, height, width = grad_input.size()
+
+    top_diff = grad_output.permute(0, 2, 3, 1).contiguous().view(-1, num_channels)
+    bottom_diff = grad_input.new(batch_size * height * width, num_channels).zero_()
+    for idx_h, ratio_h in taps_h:
+        for idx_w, ratio_w in taps_w:
+            bottom_diff.index_add_(0, _locations(roi_batch_ind, idx_h, idx_w, height, width),
+                                   top_diff * (_ratio(ratio_h, ratio_w) * scale))
+
+    grad_input.copy_(bottom_diff.view(batch_size, height, width, num_channels).permute(0, 3, 1, 2))
+
+
+def _copy_output(top_data, output):
+    num_rois, num_channels, aligned_height, aligned_width = output.size()
+    output.copy_(top_data.view(num_rois, aligned_height, aligned_width, num_channels).permute(0, 3, 1, 2))
+
+
+def roi_align_forward_cpu(aligned_height, aligned_width, spatial_scale, features, rois, output):
+    if _no_rois(rois):
+        return 1
+    roi_batch_ind, h, w, _, _ = _roi_grid(aligned_height, aligned_width, spatial_scale, rois, False)
+    height, width = features.size(2), features.size(3)
+
+    top_data = _interpolate(features, roi_batch_ind, _bilinear_taps(h, height), _bilinear_taps(w, width))
+    _copy_output(top_data, output)
+    return 1
+
+
+def roi_align_backward_cpu(aligned_height, aligned_width, spatial_scale, top_grad, rois, bottom_grad):
+    if _no_rois(rois):
+        return 1
+    roi_batch_ind, h, w, _, _ = _roi_grid(aligned_height, aligned_width, spatial_scale, rois, False)
+    height, width = bottom_grad.size(2), bottom_grad.size(3)
+
+    _scatter(top_grad, roi_batch_ind, _bilinear_taps(h, height), _bilinear_taps(w, width), bottom_grad)
+    return 1
+
+
+def roi_align_ada_forward_cpu(aligned_height, aligned_width, spatial_scale, features, rois, output):
+    if _no_rois(rois):
+        return 1
+    roi_batch_ind, h, w, bin_size_h, bin_size_w = _roi_grid(aligned_height, aligned_width, spatial_scale, rois, True)
+    height, width = features.size(2), features.size(3)
+
+    top_data = _interpolate(features, roi_batch_ind,
+                            _adaptive_taps(h, bin_size_h, height), _adaptive_taps(w, bin_size_w, width))
+    _copy_output(top_data, output)
+    return 1
+
+
+def roi_align_ada_backward_cpu(aligned_height, aligned_width, spatial_scale, top_grad, rois, bottom_grad):
+    if _no_rois(rois):
+        return 1
+    roi_batch_ind, h, w, bin_size_h, bin_size_w = _roi_grid(aligned_height, aligned_width, spatial_scale, rois, True)
+    height, width = bottom_grad.size(2), bottom_grad.size(3)
+
+    _scatter(top_grad, roi_batch_ind,
+             _adaptive_taps(h, bin_size_h, height), _adaptive_taps(w, bin_size_w, width), bottom_grad)
+    return 1
+
+
+def roi_align_dense_ada_forward_cpu(aligned_height, aligned_width, spatial_scale, features, rois, output):
+    if _no_rois(rois):
+        return 1
+    roi_batch_ind, h, w, bin_size_h, bin_size_w = _roi_grid(aligned_height, aligned_width, spatial_scale, rois, True)
+    height, width = features.size(2), features.size(3)
+
+    taps_h = _dense_adaptive_taps(h, bin_size_h, height)
+    taps_w = _dense_adaptive_taps(w, bin_size_w, width)
+    top_data = _interpolate(features, roi_batch_ind, taps_h, taps_w)
+
+    # normalize by the sum of the tap weights, rois outside the map stay zero
+    ratio_sum = _ratio(sum([ratio for _, ratio in taps_h]), sum([ratio for _, ratio in taps_w]))
+    ratio_sum += (ratio_sum == 0).float()
+    top_data.div_(ratio_sum)
+
+    _copy_output(top_data, output)
+    return 1
+
+
+def roi_align_dense_ada_backward_cpu(aligned_height, aligned_width, spatial_scale, top_grad, rois, bottom_grad):
+    if _no_rois(rois):
+        return 1
+    roi_batch_ind, h, w, bin_size_h, bin_size_w = _roi_grid(aligned_height, aligned_width, spatial_scale, rois, True)
+    height, width = bottom_grad.size(2), bottom_grad.size(3)
+
+    _scatter(top_grad, roi_batch_ind,
+             _dense_adaptive_grad_taps(h, bin_size_h, height), _dense_adaptive_grad_taps(w, bin_size_w, width),
+             bottom_grad, 1. / 2.505)
+    return 1
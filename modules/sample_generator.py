@@ -3,36 +3,115 @@ from PIL import Image
 
 from utils import *
 
-def gen_samples(generator, bbox, n, overlap_range=None, scale_range=None):
+def in_band(samples, bbox, overlap_range=None, scale_range=None):
+    ## samples whose overlap with bbox and area ratio to bbox are in the given ranges
+    idx = np.ones(len(samples), dtype=bool)
+    if overlap_range is not None:
+        r = overlap_ratio(samples, bbox)
+        idx *= (r >= overlap_range[0]) * (r <= overlap_range[1])
+    if scale_range is not None:
+        s = np.prod(samples[:,2:], axis=1) / np.prod(bbox[2:])
+        idx *= (s >= scale_range[0]) * (s <= scale_range[1])
+    return idx
+
+
+def bisect(cond, low, high, n_iter=20):
+    ## cond(t) is False at low and True at high, row by row. returns the bracket around the switch
+    for _ in range(n_iter):
+        mid = (low + high) / 2.
+        c = cond(mid)
+        high = np.where(c, mid, high)
+        low = np.where(c, low, mid)
+    return low, high
+
+
+def project_samples(samples, bbox, overlap_range=None, scale_range=None):
+    '''
+    Move samples (N x [center_x,center_y,w,h]) into the overlap and scale ranges around bbox ([x,y,w,h])
+    - the area is rescaled into scale_range, keeping the aspect ratio
+    - sizes too far from the target to reach overlap_range[0] are pulled towards the target size
+    - the center is redrawn on the ray from the target center through the sample center,
+      uniformly by area between the distances where the overlap enters and leaves the range
+    The cost is a fixed number of vectorized bisection steps.
+    '''
+    samples = np.array(samples, dtype='float64')
+    target_center = bbox[0:2] + bbox[2:4] / 2.
+    target_size = bbox[2:4].astype('float64')
+
+    if scale_range is not None:
+        area = np.prod(samples[:,2:], axis=1) / np.prod(target_size)
+        samples[:,2:] *= np.sqrt(np.clip(area, scale_range[0], scale_range[1]) / area)[:,None]
+
+    if overlap_range is None:
+        return samples
+    low, high = overlap_range
+
+    def centered_overlap(sizes):
+        intersect = np.prod(np.minimum(sizes, target_size), axis=1)
+        return intersect / (np.prod(sizes, axis=1) + np.prod(target_size) - intersect)
+
+    sizes = samples[:,2:]
+    far = centered_overlap(sizes) < low
+    if far.any():
+        log_ratio = np.log(sizes[far] / target_size)
+        _, alpha = bisect(lambda a: centered_overlap(target_size * np.exp(log_ratio * (1. - a)[:,None])) >= low,
+                          np.zeros(far.sum()), np.ones(far.sum()))
+        sizes[far] = target_size * np.exp(log_ratio * (1. - alpha)[:,None])
+
+    direction = samples[:,0:2] - target_center
+    norm = np.sqrt((direction ** 2).sum(axis=1))
+    still = norm == 0
+    angle = np.random.rand(still.sum()) * 2. * np.pi
+    direction[still] = np.stack([np.cos(angle), np.sin(angle)], axis=1)
+    direction /= np.sqrt((direction ** 2).sum(axis=1))[:,None]
+
+    def overlap_at(t):
+        boxes = np.concatenate([target_center + t[:,None] * direction - sizes / 2., sizes], axis=1)
+        return overlap_ratio(boxes, bbox)
+
+    ## distance where the boxes stop intersecting
+    with np.errstate(divide='ignore'):
+        touch = ((sizes + target_size) / 2. / np.abs(direction)).min(axis=1)
+    zeros = np.zeros(len(samples))
+    t_enter = np.where(overlap_at(zeros) <= high, zeros, bisect(lambda t: overlap_at(t) <= high, zeros, touch)[1])
+    if low > 0:
+        t_leave = bisect(lambda t: overlap_at(t) < low, zeros, touch)[0]
+    else:
+        t_leave = touch
+    t_leave = np.maximum(t_leave, t_enter)
+
+    t = np.sqrt(t_enter ** 2 + np.random.rand(len(samples)) * (t_leave ** 2 - t_enter ** 2))
+    samples[:,0:2] = target_center + t[:,None] * direction
+    return samples
+
+
+def gen_samples(generator, bbox, n, overlap_range=None, scale_range=None, n_repair=3):
+    '''
+    n samples of generator around bbox, with overlap and area ratio to bbox in the given ranges
+    The samples drawn out of the ranges are moved into them (project_samples) instead of being
+    rejected, so exactly n samples are returned at a bounded cost. Samples moved out of the ranges
+    again by the image borders are projected up to n_repair times, then replaced by copies of valid
+    samples. They are only kept out of range when no valid sample exists (unreachable ranges).
+    '''
 
     if overlap_range is None and scale_range is None:
         return generator(bbox, n)
 
-    else:
-        samples = None
-        remain = n
-        factor = 2
-        while remain > 0 and factor < 16:
-            samples_ = generator(bbox, remain*factor)
-
-            idx = np.ones(len(samples_), dtype=bool)
-            if overlap_range is not None:
-                r = overlap_ratio(samples_, bbox)
-                idx *= (r >= overlap_range[0]) * (r <= overlap_range[1])
-            if scale_range is not None:
-                s = np.prod(samples_[:,2:], axis=1) / np.prod(bbox[2:])
-                idx *= (s >= scale_range[0]) * (s <= scale_range[1])
-
-            samples_ = samples_[idx,:]
-            samples_ = samples_[:min(remain, len(samples_))]
-            if samples is None:
-                samples = samples_
-            else:
-                samples = np.concatenate([samples, samples_])
-            remain = n - len(samples)
-            factor = factor*2
+    bbox = np.asarray(bbox, dtype='float64')
+    samples = generator(bbox, n)
+    for _ in range(n_repair):
+        out = np.logical_not(in_band(samples, bbox, overlap_range, scale_range))
+        if not out.any():
+            return samples
+        centers = samples[out]
+        centers[:,0:2] += centers[:,2:] / 2.
+        samples[out] = generator.clip(project_samples(centers, bbox, overlap_range, scale_range))
 
-        return samples
+    out = np.logical_not(in_band(samples, bbox, overlap_range, scale_range))
+    if out.any() and not out.all():
+        valid = np.where(np.logical_not(out))[0]
+        samples[out] = samples[valid[np.random.randint(len(valid), size=out.sum())]]
+    return samples
 
 
 class SampleGenerator():
@@ -74,6 +153,12 @@ class SampleGenerator():
             samples[:,:2] = bb[2:]/2 + xy * (self.img_size-bb[2:]/2-1)
             samples[:,2:] *= self.scale_f ** (np.random.rand(n,1)*2-1)
 
+        return self.clip(samples)
+
+    def clip(self, samples):
+        ## N x [center_x,center_y,w,h] -> N x [min_x,min_y,w,h] inside the image range of the generator
+        samples = np.asarray(samples, dtype='float32')
+
         # adjust bbox range
         samples[:,2:] = np.clip(samples[:,2:], 5, self.img_size-5.)
         if self.valid:
@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from PIL import Image
+
+MOTIONS = ['linear', 'random_walk', 'sine']
+
+
+def target_trajectory(rng, n_frames, img_size, target_size, motion, speed, scale_amp):
+    ## n_frames x [x,y,w,h] boxes kept inside the image, the object bounces off the borders
+    width, height = img_size
+    period = max(n_frames // 2, 1)
+    t = np.arange(n_frames)
+    sizes = np.outer((1. + scale_amp) ** np.sin(2. * np.pi * t / period), target_size)
+    sizes = np.minimum(sizes, np.array([width, height]) / 2.)
+
+    center = np.array([width, height]) / 2.
+    angle = rng.uniform(0, 2. * np.pi)
+    velocity = speed * np.array([np.cos(angle), np.sin(angle)])
+    gt = np.zeros((n_frames, 4))
+    for i in range(n_frames):
+        if motion == 'sine':
+            amplitude = (np.array([width, height]) - sizes[i]) / 4.
+            center = np.array([width, height]) / 2. + amplitude * np.array([np.sin(2. * np.pi * i / period), np.sin(4. * np.pi * i / period)])
+        elif i > 0:
+            if motion == 'random_walk':
+                velocity = velocity + rng.randn(2) * speed * 0.3
+                velocity = velocity * min(1., 2. * speed / max(np.linalg.norm(velocity), 1e-6))
+            center = center + velocity
+        half = sizes[i] / 2.
+        low = half
+        high = np.array([width, height]) - half
+        bounced = np.logical_or(center < low, center > high)
+        velocity[bounced] = -velocity[bounced]
+        center = np.clip(center, low, high)
+        gt[i, 0:2] = center - half
+        gt[i, 2:4] = sizes[i]
+    return np.round(gt)
+
+
+def make_sequence(seq_path, n_frames=100, img_size=(640, 360), target_size=(64, 48), motion='linear',
+                  speed=4., scale_amp=0.1, noise=8, seed=0, quality=90):
+    '''
+    Render a synthetic sequence in the OTB layout: seq_path/img/0001.jpg ... and seq_path/groundtruth_rect.txt
+    - img_size: [w,h] of the frames, target_size: [w,h] of the object in the first frame
+    - motion: 'linear' (constant velocity), 'random_walk' (noisy velocity) or 'sine' (periodic path)
+    - speed: pixels per frame, scale_amp: relative size change over a period, noise: pixel noise amplitude
+    A textured object moves over a textured background, both drawn from seed, so the same
+    arguments give the same frames. Returns (img_list, gt) as genConfig does.
+    '''
+
+    if motion not in MOTIONS:
+        raise RuntimeError("Unknown motion: %s, expected one of %s" % (motion, MOTIONS))
+    rng = np.random.RandomState(seed)
+    width, height = img_size
+
+    ## coarse random blocks, so that the background has structure at the scale of the object
+    block = 16
+    background = rng.randint(0, 256, (height // block + 1, width // block + 1, 3))
+    background = np.repeat(np.repeat(background, block, axis=0), block, axis=1)[0:height, 0:width].astype('int16')
+
+    ## checkerboard object with two random colors and an outline
+    cells = 8
+    colors = rng.randint(0, 256, (2, 3))
+    checker = np.indices((cells, cells)).sum(axis=0) % 2
+    texture = colors[checker].astype('uint8')
+    texture[0, :] = texture[-1, :] = texture[:, 0] = texture[:, -1] = 255
+    texture = Image.fromarray(texture)
+
+    gt = target_trajectory(rng, n_frames, img_size, np.asarray(target_size, dtype='float64'), motion, speed, scale_amp)
+
+    img_dir = os.path.join(seq_path, 'img')
+    if not os.path.isdir(img_dir):
+        os.makedirs(img_dir)
+    img_list = []
+    for i in range(n_frames):
+        frame = background + rng.randint(-noise, noise + 1, background.shape)
+        x, y, w, h = gt[i].astype('int64')
+        ## rounding may push the box one pixel past the border
+        x, y = max(x, 0), max(y, 0)
+        w, h = max(min(w, width - x), 1), max(min(h, height - y), 1)
+        frame[y:y+h, x:x+w] = np.asarray(texture.resize((int(w), int(h)), Image.NEAREST))
+        img_path = os.path.join(img_dir, '%04d.jpg' % (i + 1))
+        Image.fromarray(np.clip(frame, 0, 255).astype('uint8')).save(img_path, quality=quality)
+        img_list.append(img_path)
+
+    np.savetxt(os.path.join(seq_path, 'groundtruth_rect.txt'), gt, fmt='%d', delimiter=',')
+    return img_list, gt
@@ -1,5 +1,6 @@
 from scipy.misc import imresize
 import numpy as np
+import torch
 
 
 ##################################################################################
@@ -30,6 +31,67 @@ def overlap_ratio(rect1, rect2):
     return iou
 
 
+def overlap_matrix(rect1, rect2, chunk_size=None):
+    '''
+    Compute overlap ratios between all pairs of rects
+    - rect1: N x [x,y,w,h], rect2: M x [x,y,w,h], both ndarrays or both torch tensors, of any dtype
+      (integer boxes are cast to float, double inputs stay double)
+    - chunk_size: rows of rect1 per step, bounds the temporaries to chunk_size x M (all rows if None)
+    Returns the N x M matrix, an ndarray or a tensor on the device of the inputs.
+    '''
+
+    if isinstance(rect1, np.ndarray):
+        rect1 = np.reshape(rect1, (-1,4))
+        rect2 = np.reshape(rect2, (-1,4))
+        dtype = np.result_type(rect1, rect2, 'float32')
+        rect1, rect2 = rect1.astype(dtype), rect2.astype(dtype)
+        iou = np.zeros((rect1.shape[0], rect2.shape[0]), dtype=dtype)
+        pairwise = pairwise_overlap_np
+    else:
+        rect1 = rect1.contiguous().view(-1,4)
+        rect2 = rect2.contiguous().view(-1,4)
+        if 'Double' in rect1.type() + rect2.type():
+            rect1, rect2 = rect1.double(), rect2.double()
+        else:
+            rect1, rect2 = rect1.float(), rect2.float()
+        iou = rect1.new(rect1.size(0), rect2.size(0))
+        pairwise = pairwise_overlap_torch
+
+    n = rect1.shape[0]
+    if chunk_size is None or chunk_size <= 0:
+        chunk_size = max(n, 1)
+    for start in range(0, n, chunk_size):
+        iou[start:start+chunk_size] = pairwise(rect1[start:start+chunk_size], rect2)
+    return iou
+
+
+def pairwise_overlap_np(rect1, rect2):
+    left = np.maximum(rect1[:,None,0], rect2[None,:,0])
+    right = np.minimum(rect1[:,None,0]+rect1[:,None,2], rect2[None,:,0]+rect2[None,:,2])
+    top = np.maximum(rect1[:,None,1], rect2[None,:,1])
+    bottom = np.minimum(rect1[:,None,1]+rect1[:,None,3], rect2[None,:,1]+rect2[None,:,3])
+
+    intersect = np.maximum(0,right - left) * np.maximum(0,bottom - top)
+    union = (rect1[:,2]*rect1[:,3])[:,None] + (rect2[:,2]*rect2[:,3])[None,:] - intersect
+    return np.clip(intersect / union, 0, 1)
+
+
+def pairwise_overlap_torch(rect1, rect2):
+    x1, y1 = rect1[:,0].unsqueeze(1), rect1[:,1].unsqueeze(1)
+    w1, h1 = rect1[:,2].unsqueeze(1), rect1[:,3].unsqueeze(1)
+    x2, y2 = rect2[:,0].unsqueeze(0), rect2[:,1].unsqueeze(0)
+    w2, h2 = rect2[:,2].unsqueeze(0), rect2[:,3].unsqueeze(0)
+
+    left = torch.max(x1.expand(x1.size(0), x2.size(1)), x2.expand(x1.size(0), x2.size(1)))
+    right = torch.min((x1+w1).expand(x1.size(0), x2.size(1)), (x2+w2).expand(x1.size(0), x2.size(1)))
+    top = torch.max(y1.expand(y1.size(0), y2.size(1)), y2.expand(y1.size(0), y2.size(1)))
+    bottom = torch.min((y1+h1).expand(y1.size(0), y2.size(1)), (y2+h2).expand(y1.size(0), y2.size(1)))
+
+    intersect = (right - left).clamp(min=0) * (bottom - top).clamp(min=0)
+    union = w1*h1 + w2*h2 - intersect
+    return (intersect / union).clamp(0, 1)
+
+
 def crop_image(img, bbox, img_size=[107,107], padding=16, valid=False):
     ## img_size = [w,h]
     x,y,w,h = np.array(bbox,dtype='float32')
@@ -75,8 +137,10 @@ def samples2maskroi(samples,receptive_field, cshape,padded_scene_size,padding_ra
     # rois is from domain of original image axis
     # receptive field can be subtracted to x2,y2
 
+    # cshape is [w,h] or N x [w,h] (one resized object size per sample), padded_scene_size likewise
+
     # ratios between original image and resized_image
-    cur_resize_ratio = cshape / padded_scene_size
+    cur_resize_ratio = np.reshape(np.asarray(cshape, dtype='float64') / padded_scene_size, (-1, 2))
     rois = np.copy(samples)
 
     # xywh -> x1y1x2y2
@@ -88,10 +152,70 @@ def samples2maskroi(samples,receptive_field, cshape,padded_scene_size,padding_ra
     rois[:,2:4]+=rois_paddings
 
 
-    rois[:, 0] *= cur_resize_ratio[0]
-    rois[:, 1] *= cur_resize_ratio[1]
-    rois[:, 2] = np.maximum(rois[:,0]+1,rois[:, 2]*cur_resize_ratio[0] - receptive_field)
-    rois[:, 3] = np.maximum(rois[:,1]+1,rois[:, 3]*cur_resize_ratio[1] - receptive_field)
+    rois[:, 0] *= cur_resize_ratio[:, 0]
+    rois[:, 1] *= cur_resize_ratio[:, 1]
+    rois[:, 2] = np.maximum(rois[:,0]+1,rois[:, 2]*cur_resize_ratio[:, 0] - receptive_field)
+    rois[:, 3] = np.maximum(rois[:,1]+1,rois[:, 3]*cur_resize_ratio[:, 1] - receptive_field)
 
 
     return rois
+
+
+def per_sample(x, n, width):
+    ## x given once or once per sample (n x width, or n x 1 for an isotropic value), as n x width
+    x = np.asarray(x, dtype='float64')
+    if x.ndim == 0 or (x.ndim == 1 and x.shape[0] in (1, width)):
+        x = np.reshape(x, (1,-1))
+    elif x.ndim == 1:
+        x = np.reshape(x, (-1,1))
+    return np.broadcast_to(x, (n, width))
+
+
+def build_rois(groups, receptive_field, padding_ratio):
+    '''
+    Rois of several groups of samples in one float32 array
+    - groups: list of (samples, batch_idx, scene_box, scaled_obj_size, obj_size)
+        samples: n x [x,y,w,h] in image coordinates
+        batch_idx: index of the scene in the feature map batch, once or per sample
+        scene_box: [x,y,w,h] of that scene in the image, once or n x 4
+        scaled_obj_size: size of obj_size in the cropped scene, [w,h] or isotropic, once, n x 2 or n x 1
+        obj_size: [w,h] in the image, once or n x 2
+    Returns the rois (sum of n) x [batch_idx,x1,y1,x2,y2] and the offsets of the groups,
+    group g is rois[offsets[g]:offsets[g+1]].
+    '''
+
+    counts = [np.reshape(group[0], (-1,4)).shape[0] for group in groups]
+    offsets = np.cumsum([0] + counts)
+
+    samples = np.concatenate([np.reshape(group[0], (-1,4)) for group in groups], axis=0).astype('float64')
+    batch_idx = np.concatenate([per_sample(group[1], n, 1)[:,0] for group, n in zip(groups, counts)])
+    origins = np.concatenate([per_sample(group[2], n, 4)[:,0:2] for group, n in zip(groups, counts)], axis=0)
+    cshapes = np.concatenate([per_sample(group[3], n, 2) for group, n in zip(groups, counts)], axis=0)
+    obj_sizes = np.concatenate([per_sample(group[4], n, 2) for group, n in zip(groups, counts)], axis=0)
+
+    rois = np.zeros((offsets[-1], 5), dtype='float32')
+    samples[:,0:2] -= origins
+    rois[:,0] = batch_idx
+    rois[:,1:] = samples2maskroi(samples, receptive_field, cshapes, obj_sizes, padding_ratio)
+    return rois, offsets
+
+
+def align_scene_boxes(scene_boxes, crop_sizes):
+    '''
+    Enlarge scene boxes so that they can be cropped into one batch
+    - scene_boxes: N x [x,y,w,h]
+    - crop_sizes: N x [w,h], size of each scene cropped alone
+    Every scene keeps its origin and sampling step, so the top-left
+    crop_sizes[i] pixels of its batched crop equal the crop of the scene alone.
+    '''
+
+    scene_boxes = np.array(scene_boxes, dtype='float64').reshape(-1, 4)
+    crop_sizes = np.array(crop_sizes).reshape(-1, 2).astype('int64')
+    batch_crop_size = crop_sizes.max(axis=0)
+
+    # imgCropper samples a box of width w at (w+1)/(crop_size-1) pixel steps
+    steps = (scene_boxes[:, 2:4] + 1.) / np.maximum(crop_sizes - 1, 1)
+    aligned_boxes = np.copy(scene_boxes)
+    aligned_boxes[:, 2:4] = steps * (batch_crop_size - 1) - 1.
+
+    return aligned_boxes, batch_crop_size
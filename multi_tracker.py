@@ -0,0 +1,174 @@
+from tracker import *
+
+
+##################################################################################
+############################Do not modify opts anymore.###########################
+######################Becuase of synchronization of options#######################
+##################################################################################
+
+def crop_pixels(box, scale):
+    return np.prod(box[2:4]*scale)
+
+
+def merge_search_regions(scene_boxes, scales):
+    '''
+    Greedily group overlapping search regions so that each group is cropped once
+    - scene_boxes: N x [x,y,w,h]
+    - scales: N x [sx,sy], crop pixels per image pixel of each region
+    Two regions are merged when they overlap, their scales differ less than opts['merge_scale_f']
+    and the crop of their union is not larger than the two crops together.
+    Returns the member indices, the box and the scale of every group.
+    '''
+
+    groups = []
+    group_boxes = []
+    group_scales = []
+    for t in range(len(scene_boxes)):
+        box = np.asarray(scene_boxes[t], dtype='float64')
+        scale = np.asarray(scales[t], dtype='float64')
+        merged = False
+        for g in range(len(groups)):
+            if overlap_ratio(group_boxes[g], box)[0] <= 0:
+                continue
+            if np.any(np.maximum(group_scales[g]/scale, scale/group_scales[g]) > opts['merge_scale_f']):
+                continue
+            members = groups[g] + [t]
+            member_scales = np.asarray([scales[m] for m in members], dtype='float64')
+            new_scale = np.exp(np.log(member_scales).mean(axis=0))
+            new_box = union_box(np.stack([group_boxes[g], box]))
+            if crop_pixels(new_box, new_scale) > crop_pixels(group_boxes[g], group_scales[g]) + crop_pixels(box, scale):
+                continue
+            groups[g] = members
+            group_boxes[g] = new_box
+            group_scales[g] = new_scale
+            merged = True
+            break
+        if not merged:
+            groups.append([t])
+            group_boxes.append(box)
+            group_scales.append(scale)
+
+    return groups, group_boxes, group_scales
+
+
+def shared_scene_pass(model, img_crop_model, image, targets, scenes, step):
+    ## crop the merged scenes of several targets into one batch, run conv1-conv3 once
+    ## and call step(target, feat_map, batch index, scene box, scale) for every target.
+    ## returns the groups of targets, their scenes and the feature map
+    scene_boxes = [box for box, _ in scenes]
+    scales = [scale for _, scale in scenes]
+    groups, group_boxes, group_scales = merge_search_regions(scene_boxes, scales)
+
+    group_boxes = np.stack(group_boxes)
+    group_scales = np.stack(group_scales)
+    feat_map = scene_feat_maps(model, img_crop_model, image, group_boxes, group_boxes[:,2:4]*group_scales)
+
+    for gidx, members in enumerate(groups):
+        for t in members:
+            step(targets[t], feat_map, gidx, group_boxes[gidx], group_scales[gidx])
+    return groups, group_boxes, group_scales, feat_map
+
+
+def run_mdnet_multi(img_list, init_bboxes, gt=None):
+    '''
+    Track several targets in one sequence
+    - init_bboxes: N x [x,y,w,h], first frame box of every target
+    - gt: optional T x N x [x,y,w,h]
+    Every frame is decoded once and the conv layers run once per frame and stage.
+    The conv weights are shared, fc layers, bbox regressor and sample memories are kept per target.
+    '''
+
+    init_bboxes = np.reshape(np.asarray(init_bboxes, dtype='float64'), (-1,4))
+    n_targets = init_bboxes.shape[0]
+
+    result = np.zeros((len(img_list),n_targets,4))
+    result_bb = np.zeros((len(img_list),n_targets,4))
+    result[0] = np.copy(init_bboxes)
+    result_bb[0] = np.copy(init_bboxes)
+
+    if not opts['use_gpu'] and opts['n_threads'] > 0:
+        torch.set_num_threads(opts['n_threads'])
+
+    # Init model
+    model = cached_model()
+
+    # Init image crop model
+    img_crop_model = load_cropper()
+
+    frames = open_frames(img_list, opts['n_prefetch'], opts['n_decode_workers'])
+
+    tic = time.time()
+    # Load first image
+    cur_image = next(frames)
+
+    ## every target crops the first frame from the same uploaded copy
+    targets = [Target(target_model(model), img_crop_model, cur_image, init_bboxes[t]) for t in range(n_targets)]
+    img_crop_model.invalidate()
+    if opts['use_gpu']:
+        torch.cuda.empty_cache()
+
+    spf_total = time.time()-tic
+
+    # Main loop
+    n_frames = len(img_list)
+    for i in range(1,len(img_list)):
+
+        tic = time.time()
+        # Load image
+        try:
+            cur_image = next(frames)
+        except StopIteration:
+            ## a video ended before its probed length, the results stop at its last frame
+            print "the frames ended after %d of %d, results are truncated" % (i, len(img_list))
+            n_frames = i
+            break
+        ishape = cur_image.shape
+
+        # Estimate target bboxes
+        model.eval()
+        scenes = [target.search_scene(ishape) for target in targets]
+        groups, group_boxes, group_scales, feat_map = shared_scene_pass(model, img_crop_model, cur_image, targets, scenes,
+                          lambda target, feat_map, bidx, box, scale: target.estimate(feat_map, bidx, box, scale))
+
+        for t, target in enumerate(targets):
+            result[i,t] = target.target_bbox
+            result_bb[i,t] = target.bbreg_bbox
+
+        # Data collect, on the estimation feature map when it covers the collection scene
+        collected = []
+        scenes = []
+        for gidx, members in enumerate(groups):
+            for t in [t for t in members if targets[t].success]:
+                scene = targets[t].collect_scene(ishape)
+                if opts['shared_collect_crop'] and box_covers(group_boxes[gidx], scene[0]):
+                    targets[t].collect(feat_map, gidx, group_boxes[gidx], group_scales[gidx])
+                else:
+                    collected.append(targets[t])
+                    scenes.append(scene)
+        if len(collected) > 0:
+            shared_scene_pass(model, img_crop_model, cur_image, collected, scenes,
+                              lambda target, feat_map, bidx, box, scale: target.collect(feat_map, bidx, box, scale))
+
+        img_crop_model.invalidate()
+
+        for target in targets:
+            target.update()
+
+        spf = time.time()-tic
+        spf_total += spf
+
+        if opts['visual_log']:
+            scores = ' '.join(['%.3f' % (target.target_score) for target in targets])
+            if gt is None:
+                print "Frame %d/%d, Scores %s, Time %.3f" % (i, len(img_list), scores, spf)
+            else:
+                overlaps = ' '.join(['%.3f' % (overlap_ratio(gt[i,t],result_bb[i,t])[0]) for t in range(n_targets)])
+                print "Frame %d/%d, Overlaps %s, Scores %s, Time %.3f" % (i, len(img_list), overlaps, scores, spf)
+
+    frames.close()
+    result, result_bb = result[0:n_frames], result_bb[0:n_frames]
+    if opts['visual_log']:
+        print "Waited %.3f s for frames (%.4f s/frame)" % (frames.total_stall(), frames.total_stall()/n_frames)
+
+    fps = n_frames / spf_total
+    return result_bb, fps, result
@@ -2,9 +2,15 @@ from collections import OrderedDict
 
 opts = OrderedDict()
 opts['use_gpu'] = True
+opts['n_threads'] = 0 # intra-op threads when running on cpu, 0 = torch default
+opts['n_prefetch'] = 8 # frames decoded ahead of the tracking loop
+opts['n_decode_workers'] = 2 # threads decoding frames
+opts['profile_stages'] = False # time load/crop/conv/roi_align/score/bbreg/collect/train per frame, synchronizes the gpu around every stage
 
 
 opts['model_path'] = './models/model_imagenet_seqbatch50_final.pth'
+opts['compile_graphs'] = False # run conv1-conv3 and fc4-fc6 scoring as scripted graphs (torch >= 1.2)
+opts['graph_cache'] = './models/compiled' # compiled graphs are saved here and reused by later processes
 
 opts['img_size'] = 107
 opts['padding'] = 1.2
@@ -20,10 +26,17 @@ opts['n_samples'] = 256
 opts['trans_f'] = 0.6
 opts['scale_f'] = 1.05
 opts['trans_f_expand'] = 1.4
+opts['merge_scale_f'] = 1.1 # search regions of several targets are cropped together when their scales differ less than this
+opts['stream_batch'] = 32 # streams cropped into one conv batch by StreamScheduler
+opts['shared_collect_crop'] = True # after a successful frame the estimation crop also covers the collection samples, one conv forward per frame
+opts['quantize_head'] = False # score candidates with int8 fc layers after the initial training (cpu, torch >= 1.3)
 
 opts['n_bbreg'] = 1000
 opts['overlap_bbreg'] = [0.6, 1]
 opts['scale_bbreg'] = [1, 2]
+opts['bbreg_update'] = False # refresh the bbox regressor on successful frames, with samples around the regressed box
+opts['n_bbreg_update'] = 50
+opts['bbreg_refit_interval'] = 10 # successful frames between two solves of the regressor (up to 2000 x 2000), the samples are added every frame
 
 opts['lr_init'] = 0.0001 # original = 0.0001
 opts['maxiter_init'] = 50 # original = 30
@@ -40,8 +53,8 @@ opts['overlap_pos_update'] = [0.7, 1]
 opts['overlap_neg_update'] = [0, 0.3]
 
 opts['success_thr'] = 0. # original = 0
-opts['n_frames_short'] = 20
-opts['n_frames_long'] = 100
+opts['n_frames_short'] = 20 # negative memory of n_frames_short x n_neg_update rows, 3.7 MB per frame with 4608-d roi features (0.4 MB with frozen_layers ['fc4'])
+opts['n_frames_long'] = 100 # positive memory of n_frames_long x n_pos_update rows, 0.9 MB per frame (0.1 MB), both memories grow 10 frames at a time up to their cap
 opts['long_interval'] = 10
 
 opts['w_decay'] = 0.0005 # original = 0.0005
@@ -49,6 +62,7 @@ opts['momentum'] = 0.9
 opts['grad_clip'] = 10 # original = 10
 opts['lr_mult'] = {'fc6':10}
 opts['ft_layers'] = ['fc']
+opts['frozen_layers'] = [] # leading fc layers frozen after the initial training, e.g. ['fc4'], their outputs are cached for the online updates
 
 
 
@@ -0,0 +1,123 @@
+from multi_tracker import *
+
+
+##################################################################################
+############################Do not modify opts anymore.###########################
+######################Becuase of synchronization of options#######################
+##################################################################################
+
+def batch_feat_maps(model, img_crop_model, images, scene_boxes, crop_img_sizes):
+    ## crop one scene of every image into a single batch and run conv1-conv3 once
+    batch_scene_boxes, batch_crop_img_size = align_scene_boxes(scene_boxes, crop_img_sizes)
+    cropped_images = []
+    with stage('crop'):
+        for bidx in range(len(images)):
+            cropped_image, _ = img_crop_model.crop_image(images[bidx], batch_scene_boxes[bidx:bidx+1], batch_crop_img_size)
+            cropped_images.append(cropped_image)
+        cropped_image = torch.cat(cropped_images, 0) - 128.
+    with stage('conv'):
+        return model(cropped_image, out_layer='conv3')
+
+
+class StreamScheduler():
+    '''
+    Track one target in each of many independent streams
+    The frames of all streams are processed together: their search regions are cropped
+    into one batch, conv1-conv3 and RoIAlign run once for the batch (the stream is the
+    roi batch index) and the features are handed back to the fc layers of every stream.
+    '''
+
+    def __init__(self, model=None, img_crop_model=None):
+        if model is None:
+            model = cached_model()
+        if img_crop_model is None:
+            img_crop_model = load_cropper()
+        self.model = model
+        self.img_crop_model = img_crop_model
+        self.streams = OrderedDict()
+        self.next_id = 0
+
+    def add_stream(self, image, init_bbox):
+        ## start tracking init_bbox in a new stream, returns the stream id
+        stream_id = self.next_id
+        self.next_id += 1
+        self.streams[stream_id] = Target(target_model(self.model), self.img_crop_model, image, init_bbox)
+        self.img_crop_model.invalidate()
+        if opts['use_gpu']:
+            torch.cuda.empty_cache()
+        return stream_id
+
+    def remove_stream(self, stream_id):
+        del self.streams[stream_id]
+
+    def step(self, frames):
+        '''
+        Track the current frame of several streams
+        - frames: dict of stream id -> image (H x W x 3 ndarray)
+        Returns a dict of stream id -> (bbreg bbox, target bbox, score)
+        '''
+
+        stream_ids = [s for s in frames.keys() if s in self.streams]
+        results = dict()
+        for start in range(0, len(stream_ids), opts['stream_batch']):
+            batch_ids = stream_ids[start:start+opts['stream_batch']]
+            targets = [self.streams[s] for s in batch_ids]
+            images = [frames[s] for s in batch_ids]
+            self.step_batch(targets, images)
+
+            for s, target in zip(batch_ids, targets):
+                results[s] = (target.bbreg_bbox, target.target_bbox, target.target_score)
+        return results
+
+    def step_batch(self, targets, images):
+        model = self.model
+        model.eval()
+
+        # Estimate target bboxes
+        scenes = [target.search_scene(image.shape) for target, image in zip(targets, images)]
+        feat_map, scene_boxes, scales = self.batch_pass(targets, images, scenes, self.estimate_step)
+
+        # Data collect, on the estimation feature map when it covers the collection scene
+        reused = []
+        collected = []
+        scenes = []
+        for t in [t for t in range(len(targets)) if targets[t].success]:
+            scene = targets[t].collect_scene(images[t].shape)
+            if opts['shared_collect_crop'] and box_covers(scene_boxes[t], scene[0]):
+                reused.append(t)
+            else:
+                collected.append(t)
+                scenes.append(scene)
+        if len(reused) > 0:
+            self.collect_step([targets[t] for t in reused], feat_map, scene_boxes[reused], scales[reused], reused)
+        if len(collected) > 0:
+            self.batch_pass([targets[t] for t in collected], [images[t] for t in collected], scenes, self.collect_step)
+
+        ## the cropper caches one frame only, the streams of a batch alternate frames
+        self.img_crop_model.invalidate()
+
+        for target in targets:
+            target.update()
+
+    def batch_pass(self, targets, images, scenes, step):
+        scene_boxes = np.stack([box for box, _ in scenes])
+        scales = np.stack([scale for _, scale in scenes])
+        feat_map = batch_feat_maps(self.model, self.img_crop_model, images, scene_boxes, scene_boxes[:,2:4]*scales)
+        step(targets, feat_map, scene_boxes, scales)
+        return feat_map, scene_boxes, scales
+
+    def estimate_step(self, targets, feat_map, scene_boxes, scales):
+        groups = [target.search_group(bidx, scene_boxes[bidx], scales[bidx]) for bidx, target in enumerate(targets)]
+        for target, sample_feats in zip(targets, group_features(self.model, feat_map, groups)):
+            target.locate(sample_feats)
+
+    def collect_step(self, targets, feat_map, scene_boxes, scales, batch_idx=None):
+        ## batch_idx: batch index of every target in feat_map, targets are in batch order if None
+        if batch_idx is None:
+            batch_idx = range(len(targets))
+        groups = [target.collect_groups(bidx, scene_boxes[t], scales[t]) for t, (bidx, target) in enumerate(zip(batch_idx, targets))]
+        feats = group_features(self.model, feat_map, [g for target_groups in groups for g in target_groups])
+        pointer = 0
+        for target, target_groups in zip(targets, groups):
+            target.store(*feats[pointer:pointer+len(target_groups)])
+            pointer += len(target_groups)
@@ -17,6 +17,8 @@ from model import *
 from bbreg import *
 from options import *
 from img_cropper import *
+from frame_source import *
+from profiler import *
 from roi_align.modules.roi_align import RoIAlignAvg,RoIAlignMax,RoIAlignAdaMax,RoIAlignDenseAdaMax
 
 #np.random.seed(123)
@@ -29,6 +31,76 @@ from roi_align.modules.roi_align import RoIAlignAvg,RoIAlignMax,RoIAlignAdaMax,R
 ######################Becuase of synchronization of options#######################
 ##################################################################################
 
+def to_device(x):
+    if opts['use_gpu']:
+        return x.cuda()
+    return x
+
+
+def roi_group(samples, batch_idx, scene_boxes, scaled_obj_sizes, obj_size):
+    ## build_rois group of samples[i] in scene batch_idx[i] of a batch of scene_boxes
+    ## scaled_obj_sizes holds one [w,h] (or one isotropic size) per scene
+    cshapes = np.reshape(scaled_obj_sizes, (scene_boxes.shape[0], -1))[batch_idx]
+    return samples, batch_idx, scene_boxes[batch_idx], cshapes, obj_size
+
+
+def tiled_group(samples, idx, scene_boxes, scaled_obj_sizes, obj_size):
+    ## rows idx of the samples repeated in every scene, row r is sample r % n in scene r // n
+    n = samples.shape[0]
+    return roi_group(samples[idx % n], idx // n, scene_boxes, scaled_obj_sizes, obj_size)
+
+
+def replicate_index(n_samples, n_per_replicate):
+    return np.arange(n_samples) // max(n_per_replicate, 1)
+
+
+def get_padded_scene_box(samples):
+    ## smallest box covering every sample with its context padding
+    padded_x1 = (samples[:,0]-samples[:,2]*(opts['padding']-1.)/2.).min()
+    padded_y1 = (samples[:,1]-samples[:,3]*(opts['padding']-1.)/2.).min()
+    padded_x2 = (samples[:,0]+samples[:,2]*(opts['padding']+1.)/2.).max()
+    padded_y2 = (samples[:,1]+samples[:,3]*(opts['padding']+1.)/2.).max()
+    return np.asarray((padded_x1,padded_y1,padded_x2-padded_x1,padded_y2-padded_y1))
+
+
+def union_box(boxes):
+    boxes = np.reshape(boxes, (-1,4))
+    x1 = boxes[:,0].min()
+    y1 = boxes[:,1].min()
+    x2 = (boxes[:,0]+boxes[:,2]).max()
+    y2 = (boxes[:,1]+boxes[:,3]).max()
+    return np.asarray((x1,y1,x2-x1,y2-y1))
+
+
+def box_covers(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and \
+           outer[0]+outer[2] >= inner[0]+inner[2] and outer[1]+outer[3] >= inner[1]+inner[3]
+
+
+def scene_feat_maps(model, img_crop_model, image, scene_boxes, crop_img_sizes):
+    ## crop several scenes of one image into a single batch and run conv1-conv3 once
+    batch_scene_boxes, batch_crop_img_size = align_scene_boxes(scene_boxes, crop_img_sizes)
+    with stage('crop'):
+        cropped_image, _ = img_crop_model.crop_image(image, batch_scene_boxes, batch_crop_img_size)
+        cropped_image = cropped_image - 128.
+    with stage('conv'):
+        return model(cropped_image, out_layer='conv3')
+
+
+def roi_features(model, feat_map, rois):
+    with stage('roi_align'):
+        rois = to_device(Variable(torch.from_numpy(rois)))
+        feats = model.roi_align_model(feat_map, rois)
+        return feats.view(feats.size(0), -1).data.clone()
+
+
+def group_features(model, feat_map, groups):
+    ## features of several build_rois groups: one roi array, one transfer and one RoIAlign call
+    rois, offsets = build_rois(groups, model.receptive_field, opts['padding'])
+    feats = roi_features(model, feat_map, rois)
+    return [feats[int(offsets[g]):int(offsets[g+1])] for g in range(len(groups))]
+
+
 def set_optimizer(model, lr_base, lr_mult=opts['lr_mult'], momentum=opts['momentum'], w_decay=opts['w_decay']):
     params = model.get_learnable_params()
     param_list = []
@@ -43,55 +115,49 @@ def set_optimizer(model, lr_base, lr_mult=opts['lr_mult'], momentum=opts['moment
     return optimizer
 
 
-def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='fc4'):
-    model.train()
+def minibatch_index(rows, batch_size, maxiter):
+    ## maxiter x batch_size rows, drawn epoch by epoch from random permutations of rows
+    if len(rows) == 0:
+        raise ValueError("no rows to draw minibatches from")
+    n_epochs = int(np.ceil(batch_size * maxiter / float(len(rows))))
+    idx = np.concatenate([np.random.permutation(rows) for _ in range(n_epochs)])
+    return to_device(torch.from_numpy(idx[0:batch_size*maxiter].reshape(maxiter, batch_size)).long())
+
 
+def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='fc4', pos_rows=None, neg_rows=None):
+    ## pos_rows/neg_rows: rows of pos_feats/neg_feats to train on, all rows if None
     batch_pos = opts['batch_pos']
     batch_neg = opts['batch_neg']
-    batch_test = opts['batch_test']
     batch_neg_cand = max(opts['batch_neg_cand'], batch_neg)
 
-    pos_idx = np.random.permutation(pos_feats.size(0))
-    neg_idx = np.random.permutation(neg_feats.size(0))
-    while(len(pos_idx) < batch_pos*maxiter):
-        pos_idx = np.concatenate([pos_idx, np.random.permutation(pos_feats.size(0))])
-    while(len(neg_idx) < batch_neg_cand*maxiter):
-        neg_idx = np.concatenate([neg_idx, np.random.permutation(neg_feats.size(0))])
-    pos_pointer = 0
-    neg_pointer = 0
+    if pos_rows is None:
+        pos_rows = np.arange(pos_feats.size(0))
+    if neg_rows is None:
+        neg_rows = np.arange(neg_feats.size(0))
+    ## nothing to train on (e.g. an empty memory window), the model is left as it is
+    if len(pos_rows) == 0 or len(neg_rows) == 0:
+        return
 
-    for iter in range(maxiter):
+    model.train()
 
-        # select pos idx
-        pos_next = pos_pointer+batch_pos
-        pos_cur_idx = pos_idx[pos_pointer:pos_next]
-        pos_cur_idx = pos_feats.new(pos_cur_idx).long()
-        pos_pointer = pos_next
+    ## indices of every iteration, drawn at once
+    pos_idx = minibatch_index(pos_rows, batch_pos, maxiter)
+    neg_idx = minibatch_index(neg_rows, batch_neg_cand, maxiter)
 
-        # select neg idx
-        neg_next = neg_pointer+batch_neg_cand
-        neg_cur_idx = neg_idx[neg_pointer:neg_next]
-        neg_cur_idx = neg_feats.new(neg_cur_idx).long()
-        neg_pointer = neg_next
+    for iter in range(maxiter):
 
         # create batch
-        batch_pos_feats = Variable(pos_feats.index_select(0, pos_cur_idx))
-        batch_neg_feats = Variable(neg_feats.index_select(0, neg_cur_idx))
+        batch_pos_feats = Variable(pos_feats.index_select(0, pos_idx[iter]))
+        batch_neg_feats = neg_feats.index_select(0, neg_idx[iter])
 
-        # hard negative mining
+        # hard negative mining, candidates are scored at once without autograd and dropout,
+        # with the fp32 weights being trained (the int8 ones are refreshed once, after the loop)
         if batch_neg_cand > batch_neg:
-            model.eval() ## model transfer into evaluation mode
-            for start in range(0,batch_neg_cand,batch_test):
-                end = min(start+batch_test,batch_neg_cand)
-                score = model(batch_neg_feats[start:end], in_layer=in_layer)
-                if start==0:
-                    neg_cand_score = score.data[:,1].clone()
-                else:
-                    neg_cand_score = torch.cat((neg_cand_score, score.data[:,1].clone()),0)
-
+            with no_grad():
+                neg_cand_score = model.score(inference_variable(batch_neg_feats), in_layer=in_layer, quantized=False).data[:,1]
             _, top_idx = neg_cand_score.topk(batch_neg)
-            batch_neg_feats = batch_neg_feats.index_select(0, Variable(top_idx))
-            model.train() ## model transfer into train mode
+            batch_neg_feats = batch_neg_feats.index_select(0, top_idx)
+        batch_neg_feats = Variable(batch_neg_feats)
 
         # forward
         pos_score = model(batch_pos_feats, in_layer=in_layer)
@@ -107,27 +173,16 @@ def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='
         if opts['visual_log']:
             print "Iter %d, Loss %.4f" % (iter, loss.data[0])
 
+    model.requantize() ## int8 weights follow the trained ones, no-op in fp32
 
 
 
-def run_mdnet(img_list, init_bbox, gt=None, seq='seq_name ex)Basketball', savefig_dir='', display=False):
 
-    ############################################
-    ############################################
-    ############################################
-    # Init bbox
-    target_bbox = np.array(init_bbox)
-    result = np.zeros((len(img_list),4))
-    result_bb = np.zeros((len(img_list),4))
-    result[0] = np.copy(target_bbox)
-    result_bb[0] = np.copy(target_bbox)
 
-    iou_result = np.zeros((len(img_list),1))
 
-    # execution time array
-    exec_time_result = np.zeros((len(img_list),1))
 
-    # Init model
+
+def load_model():
     model = MDNet(opts['model_path'])
     if opts['adaptive_align']:
         align_h = model.roi_align_model.aligned_height
@@ -138,273 +193,520 @@ def run_mdnet(img_list, init_bbox, gt=None, seq='seq_name ex)Basketball', savefi
         model = model.cuda()
 
     model.set_learnable_params(opts['ft_layers'])
+    if opts['compile_graphs']:
+        model.compile(opts['graph_cache'])
+    return model
+
 
-    # Init image crop model
+def load_cropper():
     img_crop_model = imgCropper(1.)
     if opts['use_gpu']:
         img_crop_model.gpuEnable()
+    return img_crop_model
 
-    # Init criterion and optimizer
-    criterion = BinaryLoss()
-    init_optimizer = set_optimizer(model, opts['lr_init'])
-    update_optimizer = set_optimizer(model, opts['lr_update'])
 
-    tic = time.time()
-    # Load first image
-    cur_image = Image.open(img_list[0]).convert('RGB')
-    cur_image = np.asarray(cur_image)
-
-    # Draw pos/neg samples
-    ishape = cur_image.shape
-    pos_examples = gen_samples(SampleGenerator('gaussian', (ishape[1],ishape[0]), 0.1, 1.2),
-                               target_bbox, opts['n_pos_init'], opts['overlap_pos_init'])
-    neg_examples = gen_samples(SampleGenerator('uniform', (ishape[1],ishape[0]), 1, 2, 1.1),
-                                target_bbox, opts['n_neg_init'], opts['overlap_neg_init'])
-    neg_examples = np.random.permutation(neg_examples)
-
-    cur_bbreg_examples = gen_samples(SampleGenerator('uniform', (ishape[1],ishape[0]), 0.3, 1.5, 1.1),
-                                 target_bbox, opts['n_bbreg'], opts['overlap_bbreg'], opts['scale_bbreg'])
-
-    # compute padded sample
-    padded_x1 = (neg_examples[:,0]-neg_examples[:,2]*(opts['padding']-1.)/2.).min()
-    padded_y1 = (neg_examples[:,1]-neg_examples[:,3]*(opts['padding']-1.)/2.).min()
-    padded_x2 = (neg_examples[:,0]+neg_examples[:,2]*(opts['padding']+1.)/2.).max()
-    padded_y2 = (neg_examples[:,1]+neg_examples[:,3]*(opts['padding']+1.)/2.).max()
-    padded_scene_box = np.reshape(np.asarray((padded_x1,padded_y1,padded_x2-padded_x1,padded_y2-padded_y1)),(1,4))
-
-    scene_boxes = np.reshape(np.copy(padded_scene_box), (1,4))
-    if opts['jitter']:
-        ## horizontal shift
-        jittered_scene_box_horizon = np.copy(padded_scene_box)
-        jittered_scene_box_horizon[0,0] -= 4.
-        jitter_scale_horizon = 1.
-
-        ## vertical shift
-        jittered_scene_box_vertical = np.copy(padded_scene_box)
-        jittered_scene_box_vertical[0,1] -= 4.
-        jitter_scale_vertical = 1.
-
-        jittered_scene_box_reduce1 = np.copy(padded_scene_box)
-        jitter_scale_reduce1 = 1.1 ** (-1)
-
-        ## vertical shift
-        jittered_scene_box_enlarge1 = np.copy(padded_scene_box)
-        jitter_scale_enlarge1 = 1.1 ** (1)
-
-        ## scale reduction
-        jittered_scene_box_reduce2 = np.copy(padded_scene_box)
-        jitter_scale_reduce2 = 1.1**(-2)
-        ## scale enlarge
-        jittered_scene_box_enlarge2 = np.copy(padded_scene_box)
-        jitter_scale_enlarge2 = 1.1 ** (2)
-
-        scene_boxes = np.concatenate([scene_boxes, jittered_scene_box_horizon, jittered_scene_box_vertical,jittered_scene_box_reduce1,jittered_scene_box_enlarge1,jittered_scene_box_reduce2,jittered_scene_box_enlarge2],axis=0)
-        jitter_scale = [1.,jitter_scale_horizon,jitter_scale_vertical,jitter_scale_reduce1,jitter_scale_enlarge1,jitter_scale_reduce2,jitter_scale_enlarge2]
-    else:
-        jitter_scale = [1.]
-
-    model.eval()
-    for bidx in range(0,scene_boxes.shape[0]):
-        crop_img_size = (scene_boxes[bidx,2:4] * ((opts['img_size'],opts['img_size'])/target_bbox[2:4])).astype('int64')*jitter_scale[bidx]
-        cropped_image, cur_image_var = img_crop_model.crop_image(cur_image, np.reshape(scene_boxes[bidx],(1,4)), crop_img_size)
-        cropped_image = cropped_image - 128.
+## pretrained models loaded once per process, keyed by the options they are built from
+base_models = dict()
+
+
+def cached_model():
+    ## the pretrained model of the current options, loaded on first use.
+    ## it is never trained: trackers get a copy from target_model, sharing its conv layers
+    key = (opts['model_path'], opts['adaptive_align'], opts['use_gpu'], opts['compile_graphs'], tuple(opts['ft_layers']))
+    if key not in base_models:
+        base_models[key] = load_model()
+    return base_models[key]
 
-        feat_map = model(cropped_image, out_layer='conv3')
-
-        rel_target_bbox = np.copy(target_bbox)
-        rel_target_bbox[0:2] -= scene_boxes[bidx,0:2]
-
-        batch_num = np.zeros((pos_examples.shape[0], 1))
-        cur_pos_rois = np.copy(pos_examples)
-        cur_pos_rois[:,0:2] -= np.repeat(np.reshape(scene_boxes[bidx,0:2],(1,2)),cur_pos_rois.shape[0],axis=0)
-        scaled_obj_size = float(opts['img_size'])*jitter_scale[bidx]
-        cur_pos_rois = samples2maskroi(cur_pos_rois, model.receptive_field,(scaled_obj_size,scaled_obj_size), target_bbox[2:4], opts['padding'])
-        cur_pos_rois = np.concatenate((batch_num, cur_pos_rois), axis=1)
-        cur_pos_rois = Variable(torch.from_numpy(cur_pos_rois.astype('float32'))).cuda()
-        cur_pos_feats = model.roi_align_model(feat_map, cur_pos_rois)
-        cur_pos_feats = cur_pos_feats.view(cur_pos_feats.size(0), -1).data.clone()
-
-        batch_num = np.zeros((neg_examples.shape[0], 1))
-        cur_neg_rois = np.copy(neg_examples)
-        cur_neg_rois[:,0:2] -= np.repeat(np.reshape(scene_boxes[bidx,0:2],(1,2)),cur_neg_rois.shape[0],axis=0)
-        cur_neg_rois = samples2maskroi(cur_neg_rois, model.receptive_field, (scaled_obj_size,scaled_obj_size), target_bbox[2:4], opts['padding'])
-        cur_neg_rois = np.concatenate((batch_num, cur_neg_rois), axis=1)
-        cur_neg_rois = Variable(torch.from_numpy(cur_neg_rois.astype('float32'))).cuda()
-        cur_neg_feats = model.roi_align_model(feat_map, cur_neg_rois)
-        cur_neg_feats = cur_neg_feats.view(cur_neg_feats.size(0), -1).data.clone()
-
-
-        ## bbreg rois
-        batch_num = np.zeros((cur_bbreg_examples.shape[0], 1))
-        cur_bbreg_rois = np.copy(cur_bbreg_examples)
-        cur_bbreg_rois[:,0:2] -= np.repeat(np.reshape(scene_boxes[bidx,0:2],(1,2)),cur_bbreg_rois.shape[0],axis=0)
-        scaled_obj_size = float(opts['img_size'])*jitter_scale[bidx]
-        cur_bbreg_rois = samples2maskroi(cur_bbreg_rois, model.receptive_field,(scaled_obj_size,scaled_obj_size), target_bbox[2:4], opts['padding'])
-        cur_bbreg_rois = np.concatenate((batch_num, cur_bbreg_rois), axis=1)
-        cur_bbreg_rois = Variable(torch.from_numpy(cur_bbreg_rois.astype('float32'))).cuda()
-        cur_bbreg_feats = model.roi_align_model(feat_map, cur_bbreg_rois)
-        cur_bbreg_feats = cur_bbreg_feats.view(cur_bbreg_feats.size(0), -1).data.clone()
-
-
-        feat_dim = cur_pos_feats.size(-1)
-
-        if bidx==0:
-            pos_feats = cur_pos_feats
-            neg_feats = cur_neg_feats
-            ##bbreg feature
-            bbreg_feats = cur_bbreg_feats
-            bbreg_examples = cur_bbreg_examples
+
+def target_model(base_model):
+    ## per-target copy of base_model, layers which are not fine-tuned online are shared
+    shared_layers = [name for name, _ in base_model.layers.named_children()
+                     if not any([name.startswith(l) for l in opts['ft_layers']])]
+    model = base_model.clone(shared_layers)
+    model.set_learnable_params(opts['ft_layers'])
+    return model
+
+
+class FeatureMemory():
+    '''
+    Features of the last n_frames frames in one ring buffer
+    - n_per_frame: rows kept per frame, extra rows are dropped
+    - chunk_frames: the buffer grows by this many frames until it holds n_frames
+    Once full, frames are written in place over the oldest one. Training reads the rows of a
+    window of frames through train(..., rows), the buffer is never stacked or copied.
+    '''
+
+    def __init__(self, n_frames, n_per_frame, feat_dim, chunk_frames=10):
+        self.n_frames = n_frames
+        self.n_per_frame = n_per_frame
+        self.chunk_frames = chunk_frames
+        self.data = to_device(torch.zeros(min(chunk_frames, n_frames) * n_per_frame, feat_dim))
+        self.counts = np.zeros(n_frames, dtype='int64')
+        self.head = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, feats):
+        ## O(1) insert, evicts the oldest frame when full
+        n = min(feats.size(0), self.n_per_frame)
+        offset = self.head * self.n_per_frame
+        if offset == self.data.size(0):
+            ## not full yet, the slots are in order and the new ones go at the end
+            n_new = min(self.chunk_frames, self.n_frames - self.head) * self.n_per_frame
+            self.data = torch.cat((self.data, self.data.new(n_new, self.data.size(1)).zero_()), 0)
+        self.data[offset:offset+n].copy_(feats[0:n])
+        self.counts[self.head] = n
+        self.head = (self.head + 1) % self.n_frames
+        self.length = min(self.length + 1, self.n_frames)
+
+    def rows(self, n_frames=None):
+        ## rows of self.data holding the last n_frames frames (all frames if None)
+        if n_frames is None or n_frames > self.length:
+            n_frames = self.length
+        slots = (self.head - 1 - np.arange(n_frames)) % self.n_frames
+        return np.concatenate([slot * self.n_per_frame + np.arange(self.counts[slot]) for slot in slots])
+
+
+class Target():
+    ## online state of one tracked object: fc layers, bbox regressor and sample memories.
+    ## conv3 feature maps are passed in, so that several targets can share one conv forward.
+
+    ## range of the negative samples collected around the target
+    collect_trans_f = 1.5
+    collect_scale_f = 1.2
+
+    def __init__(self, model, img_crop_model, image, init_bbox):
+        self.model = model
+        self.target_bbox = np.array(init_bbox)
+        self.bbreg_bbox = np.copy(self.target_bbox)
+        self.target_score = 0.
+        self.success = True
+        self.trans_f = opts['trans_f']
+        self.frame_num = 0
+        ## first layer run by the online updates, the memories hold the inputs of this layer
+        self.update_in_layer = 'fc4'
+        self.frozen_layers = None
+
+        # Init criterion and optimizer
+        self.criterion = BinaryLoss()
+        self.init_optimizer = set_optimizer(model, opts['lr_init'])
+        self.update_optimizer = set_optimizer(model, opts['lr_update'])
+
+        self.initialize(img_crop_model, image)
+
+    def crop_scale(self):
+        ## crop pixels per image pixel, the target is resized to img_size x img_size
+        return float(opts['img_size']) / self.target_bbox[2:4]
+
+    def initialize(self, img_crop_model, image):
+        model = self.model
+        target_bbox = self.target_bbox
+
+        # Draw pos/neg samples
+        ishape = image.shape
+        pos_examples = gen_samples(SampleGenerator('gaussian', (ishape[1],ishape[0]), 0.1, 1.2),
+                                   target_bbox, opts['n_pos_init'], opts['overlap_pos_init'])
+        neg_examples = gen_samples(SampleGenerator('uniform', (ishape[1],ishape[0]), 1, 2, 1.1),
+                                    target_bbox, opts['n_neg_init'], opts['overlap_neg_init'])
+        neg_examples = np.random.permutation(neg_examples)
+
+        cur_bbreg_examples = gen_samples(SampleGenerator('uniform', (ishape[1],ishape[0]), 0.3, 1.5, 1.1),
+                                     target_bbox, opts['n_bbreg'], opts['overlap_bbreg'], opts['scale_bbreg'])
+
+        # compute padded sample
+        padded_scene_box = np.reshape(get_padded_scene_box(neg_examples),(1,4))
+
+        scene_boxes = np.reshape(np.copy(padded_scene_box), (1,4))
+        if opts['jitter']:
+            ## horizontal shift
+            jittered_scene_box_horizon = np.copy(padded_scene_box)
+            jittered_scene_box_horizon[0,0] -= 4.
+            jitter_scale_horizon = 1.
+
+            ## vertical shift
+            jittered_scene_box_vertical = np.copy(padded_scene_box)
+            jittered_scene_box_vertical[0,1] -= 4.
+            jitter_scale_vertical = 1.
+
+            jittered_scene_box_reduce1 = np.copy(padded_scene_box)
+            jitter_scale_reduce1 = 1.1 ** (-1)
+
+            ## vertical shift
+            jittered_scene_box_enlarge1 = np.copy(padded_scene_box)
+            jitter_scale_enlarge1 = 1.1 ** (1)
+
+            ## scale reduction
+            jittered_scene_box_reduce2 = np.copy(padded_scene_box)
+            jitter_scale_reduce2 = 1.1**(-2)
+            ## scale enlarge
+            jittered_scene_box_enlarge2 = np.copy(padded_scene_box)
+            jitter_scale_enlarge2 = 1.1 ** (2)
+
+            scene_boxes = np.concatenate([scene_boxes, jittered_scene_box_horizon, jittered_scene_box_vertical,jittered_scene_box_reduce1,jittered_scene_box_enlarge1,jittered_scene_box_reduce2,jittered_scene_box_enlarge2],axis=0)
+            jitter_scale = [1.,jitter_scale_horizon,jitter_scale_vertical,jitter_scale_reduce1,jitter_scale_enlarge1,jitter_scale_reduce2,jitter_scale_enlarge2]
         else:
-            pos_feats = torch.cat((pos_feats,cur_pos_feats),dim=0)
-            neg_feats = torch.cat((neg_feats,cur_neg_feats),dim=0)
-            ##bbreg feature
-            bbreg_feats = torch.cat((bbreg_feats, cur_bbreg_feats),dim=0)
-            bbreg_examples = np.concatenate((bbreg_examples, cur_bbreg_examples),axis=0)
-
-    if pos_feats.size(0) > opts['n_pos_init']:
-        pos_idx = np.asarray(range(pos_feats.size(0)))
-        np.random.shuffle(pos_idx)
-        pos_feats = pos_feats[pos_idx[0:opts['n_pos_init']],:]
-    if neg_feats.size(0) > opts['n_neg_init']:
-        neg_idx = np.asarray(range(neg_feats.size(0)))
-        np.random.shuffle(neg_idx)
-        neg_feats = neg_feats[neg_idx[0:opts['n_neg_init']], :]
-
-    ##bbreg
-    if bbreg_feats.size(0) > opts['n_bbreg']:
-        bbreg_idx = np.asarray(range(bbreg_feats.size(0)))
-        np.random.shuffle(bbreg_idx)
-        bbreg_feats = bbreg_feats[bbreg_idx[0:opts['n_bbreg']], :]
-        bbreg_examples = bbreg_examples[bbreg_idx[0:opts['n_bbreg']],:]
-        #print bbreg_examples.shape
-
-
-    ## open images and crop patch from obj
-    extra_obj_size = np.array((opts['img_size'],opts['img_size']))
-    extra_crop_img_size = extra_obj_size * (opts['padding']+0.6)
-    replicateNum = 100
-    for iidx in range(replicateNum):
-        extra_target_bbox = np.copy(target_bbox)
-
-        extra_scene_box = np.copy(extra_target_bbox)
-        extra_scene_box_center = extra_scene_box[0:2] + extra_scene_box[2:4] / 2.
-        extra_scene_box_size = extra_scene_box[2:4] * (opts['padding'] + 0.6)
-        extra_scene_box[0:2] = extra_scene_box_center - extra_scene_box_size / 2.
-        extra_scene_box[2:4] = extra_scene_box_size
-
-        extra_shift_offset = np.clip(2. * np.random.randn(2), -4, 4)
-        cur_extra_scale = 1.1 ** np.clip(np.random.randn(1), -2, 2)
-
-
-        extra_scene_box[0] += extra_shift_offset[0]
-        extra_scene_box[1] += extra_shift_offset[1]
-        extra_scene_box[2:4] *= cur_extra_scale[0]
-
-        scaled_obj_size = float(opts['img_size']) / cur_extra_scale[0]
-
-        cur_extra_cropped_image, _ = img_crop_model.crop_image(cur_image, np.reshape(extra_scene_box,(1,4)),extra_crop_img_size)
-        cur_extra_cropped_image = cur_extra_cropped_image.detach()
-
-        cur_extra_pos_examples = gen_samples(SampleGenerator('gaussian', (ishape[1], ishape[0]), 0.1, 1.2),extra_target_bbox, opts['n_pos_init']/replicateNum, opts['overlap_pos_init'])
-        cur_extra_neg_examples = gen_samples(SampleGenerator('uniform', (ishape[1], ishape[0]), 0.3, 2, 1.1),extra_target_bbox, opts['n_neg_init']/replicateNum/4, opts['overlap_neg_init'])
+            jitter_scale = [1.]
 
+        model.eval()
+        ## every jittered scene is cropped into one batch, the scene index is the first roi column
+        jitter_scale = np.asarray(jitter_scale)
+        crop_img_sizes = (scene_boxes[:,2:4] * self.crop_scale()).astype('int64')*jitter_scale[:,None]
+        feat_map = scene_feat_maps(model, img_crop_model, image, scene_boxes, crop_img_sizes)
+
+        ## every sample is available in every scene, only the rois kept for training are built and aligned
+        n_scenes = scene_boxes.shape[0]
+        scaled_obj_sizes = float(opts['img_size'])*jitter_scale
+        pos_idx = np.random.permutation(n_scenes*pos_examples.shape[0])[0:opts['n_pos_init']]
+        neg_idx = np.random.permutation(n_scenes*neg_examples.shape[0])[0:opts['n_neg_init']]
+        ##bbreg
+        bbreg_idx = np.random.permutation(n_scenes*cur_bbreg_examples.shape[0])[0:opts['n_bbreg']]
+        bbreg_examples = cur_bbreg_examples[bbreg_idx % cur_bbreg_examples.shape[0]]
+
+        pos_feats, neg_feats, bbreg_feats = group_features(model, feat_map, [
+            tiled_group(pos_examples, pos_idx, scene_boxes, scaled_obj_sizes, target_bbox[2:4]),
+            tiled_group(neg_examples, neg_idx, scene_boxes, scaled_obj_sizes, target_bbox[2:4]),
+            tiled_group(cur_bbreg_examples, bbreg_idx, scene_boxes, scaled_obj_sizes, target_bbox[2:4])])
+
+        self.feat_dim = pos_feats.size(-1)
+
+
+        ## replicated scenes around the target: shifts, scales and samples are drawn for all replicates at once
+        replicateNum = 100
+        extra_obj_size = np.array((opts['img_size'],opts['img_size']))
+        extra_crop_img_size = extra_obj_size * (opts['padding']+0.6)
+
+        extra_shift_offsets = np.clip(2. * np.random.randn(replicateNum, 2), -4, 4)
+        extra_scales = 1.1 ** np.clip(np.random.randn(replicateNum), -2, 2)
+
+        extra_scene_box_center = target_bbox[0:2] + target_bbox[2:4] / 2.
+        extra_scene_box_size = target_bbox[2:4] * (opts['padding'] + 0.6)
+        extra_scene_boxes = np.zeros((replicateNum, 4))
+        extra_scene_boxes[:, 0:2] = extra_scene_box_center - extra_scene_box_size / 2. + extra_shift_offsets
+        extra_scene_boxes[:, 2:4] = extra_scene_box_size * extra_scales[:, None]
+
+        extra_scaled_obj_sizes = float(opts['img_size']) / extra_scales
+
+        extra_pos_examples = gen_samples(SampleGenerator('gaussian', (ishape[1], ishape[0]), 0.1, 1.2), target_bbox,
+                                         replicateNum * (opts['n_pos_init'] // replicateNum), opts['overlap_pos_init'])
+        extra_neg_examples = gen_samples(SampleGenerator('uniform', (ishape[1], ishape[0]), 0.3, 2, 1.1), target_bbox,
+                                         replicateNum * (opts['n_neg_init'] // replicateNum // 4), opts['overlap_neg_init'])
         ##bbreg sample
-        cur_extra_bbreg_examples = gen_samples(SampleGenerator('uniform', (ishape[1], ishape[0]), 0.3, 1.5, 1.1),extra_target_bbox, opts['n_bbreg']/replicateNum/4, opts['overlap_bbreg'], opts['scale_bbreg'])
+        extra_bbreg_examples = gen_samples(SampleGenerator('uniform', (ishape[1], ishape[0]), 0.3, 1.5, 1.1), target_bbox,
+                                           replicateNum * (opts['n_bbreg'] // replicateNum // 4), opts['overlap_bbreg'], opts['scale_bbreg'])
+
+        ## every replicate has the same crop size
+        extra_feat_maps = scene_feat_maps(model, img_crop_model, image, extra_scene_boxes, np.tile(extra_crop_img_size, (replicateNum,1)))
+
+        ## consecutive samples go to the same replicate
+        extra_pos_feats, extra_neg_feats, extra_bbreg_feats = group_features(model, extra_feat_maps, [
+            roi_group(extra_pos_examples, replicate_index(extra_pos_examples.shape[0], opts['n_pos_init'] // replicateNum),
+                      extra_scene_boxes, extra_scaled_obj_sizes, target_bbox[2:4]),
+            roi_group(extra_neg_examples, replicate_index(extra_neg_examples.shape[0], opts['n_neg_init'] // replicateNum // 4),
+                      extra_scene_boxes, extra_scaled_obj_sizes, target_bbox[2:4]),
+            ##bbreg rois
+            roi_group(extra_bbreg_examples, replicate_index(extra_bbreg_examples.shape[0], opts['n_bbreg'] // replicateNum // 4),
+                      extra_scene_boxes, extra_scaled_obj_sizes, target_bbox[2:4])])
+
+        ## concatenate extra features to original_features
+        pos_feats = torch.cat((pos_feats,extra_pos_feats),dim=0)
+        neg_feats = torch.cat((neg_feats,extra_neg_feats), dim=0)
+        ## concatenate extra bbreg feats to original_bbreg_feats
+        bbreg_feats = torch.cat((bbreg_feats, extra_bbreg_feats), dim=0)
+        bbreg_examples = np.concatenate((bbreg_examples, extra_bbreg_examples), axis=0)
+
+        if opts['use_gpu']:
+            torch.cuda.empty_cache()
+        model.zero_grad()
 
-        batch_num = iidx*np.ones((cur_extra_pos_examples.shape[0], 1))
-        cur_extra_pos_rois = np.copy(cur_extra_pos_examples)
-        cur_extra_pos_rois[:, 0:2] -= np.repeat(np.reshape(extra_scene_box[0:2], (1, 2)),
-                                                    cur_extra_pos_rois.shape[0], axis=0)
-        cur_extra_pos_rois = samples2maskroi(cur_extra_pos_rois, model.receptive_field,(scaled_obj_size, scaled_obj_size), extra_target_bbox[2:4], opts['padding'])
-        cur_extra_pos_rois = np.concatenate((batch_num, cur_extra_pos_rois), axis=1)
+        # Initial training
+        with stage('train'):
+            train(model, self.criterion, self.init_optimizer, pos_feats, neg_feats, opts['maxiter_init'])
+        if opts['quantize_head']:
+            model.quantize()
+
+        ##bbreg train
+        if bbreg_feats.size(0) > opts['n_bbreg']:
+            bbreg_idx = np.asarray(range(bbreg_feats.size(0)))
+            np.random.shuffle(bbreg_idx)
+            bbreg_feats = bbreg_feats[bbreg_idx[0:opts['n_bbreg']],:]
+            bbreg_examples = bbreg_examples[bbreg_idx[0:opts['n_bbreg']],:]
+        self.bbreg = BBRegressor((ishape[1],ishape[0]), refit_interval=opts['bbreg_refit_interval'])
+        self.bbreg.train(bbreg_feats, bbreg_examples, target_bbox)
+
+
+        if len(opts['frozen_layers']) > 0:
+            self.freeze(opts['frozen_layers'])
+
+        pos_idx = np.random.permutation(pos_feats.size(0))[0:opts['n_pos_update']]
+        pos_feats = self.cache(pos_feats.index_select(0, to_device(torch.from_numpy(pos_idx))))
+        neg_idx = np.random.permutation(neg_feats.size(0))[0:opts['n_neg_update']]
+        neg_feats = self.cache(neg_feats.index_select(0, to_device(torch.from_numpy(neg_idx))))
+
+        self.pos_memory = FeatureMemory(opts['n_frames_long'], opts['n_pos_update'], pos_feats.size(-1))
+        self.neg_memory = FeatureMemory(opts['n_frames_short'], opts['n_neg_update'], neg_feats.size(-1))
+        self.pos_memory.append(pos_feats)
+        self.neg_memory.append(neg_feats)
+
+    def freeze(self, frozen_layers):
+        ## stop training the first fc layers after the initial training, their outputs are cached in the memories
+        fc_layers = [name for name, _ in self.model.layers.named_children() if name.startswith('fc')] + ['fc6']
+        if frozen_layers != fc_layers[0:len(frozen_layers)] or len(frozen_layers) >= len(fc_layers):
+            raise RuntimeError("frozen_layers have to be leading fc layers (%s), got %s" % (fc_layers[0:-1], frozen_layers))
+
+        self.frozen_layers = frozen_layers
+        self.update_in_layer = fc_layers[len(frozen_layers)]
+        ft_layers = [l for l in fc_layers[len(frozen_layers):] if any([l.startswith(f) for f in opts['ft_layers']])]
+        self.model.set_learnable_params(ft_layers)
+        self.update_optimizer = set_optimizer(self.model, opts['lr_update'])
+
+    def cache(self, feats):
+        ## roi features -> inputs of update_in_layer
+        if self.frozen_layers is None:
+            return feats
+        with no_grad():
+            ## the memories hold fp32 activations, the layers trained on them are fp32
+            return self.model.score(inference_variable(feats), in_layer='fc4', out_layer=self.frozen_layers[-1], quantized=False).data.clone()
+
+    def search_scene(self, ishape):
+        ## draw candidates around the target, returns the scene covering them and its crop scale
+        self.samples = gen_samples(SampleGenerator('gaussian', (ishape[1], ishape[0]), self.trans_f, opts['scale_f'],valid=True), self.target_bbox, opts['n_samples'])
+
+        padded_scene_box = get_padded_scene_box(self.samples)
+        if opts['shared_collect_crop'] and self.success:
+            ## the scene also covers the samples collected around any target found among the candidates,
+            ## so that the collection on a successful frame can reuse the same feature map.
+            ## after a failed frame the search is already enlarged (trans_f) and likely to fail again,
+            ## the scene is not enlarged and a success crops the collection scene separately
+            padded_scene_box = union_box(np.stack([padded_scene_box, self.collect_extent(self.samples)]))
+        if padded_scene_box[0] > ishape[1]:
+            padded_scene_box[0] = ishape[1]-1
+        if padded_scene_box[1] > ishape[0]:
+            padded_scene_box[1] = ishape[0]-1
+        if padded_scene_box[0] + padded_scene_box[2] < 0:
+            padded_scene_box[2] = -padded_scene_box[0]+1
+        if padded_scene_box[1] + padded_scene_box[3] < 0:
+            padded_scene_box[3] = -padded_scene_box[1]+1
 
-        batch_num = iidx * np.ones((cur_extra_neg_examples.shape[0], 1))
-        cur_extra_neg_rois = np.copy(cur_extra_neg_examples)
-        cur_extra_neg_rois[:, 0:2] -= np.repeat(np.reshape(extra_scene_box[0:2], (1, 2)),cur_extra_neg_rois.shape[0], axis=0)
-        cur_extra_neg_rois = samples2maskroi(cur_extra_neg_rois, model.receptive_field,(scaled_obj_size, scaled_obj_size), extra_target_bbox[2:4], opts['padding'])
-        cur_extra_neg_rois = np.concatenate((batch_num, cur_extra_neg_rois), axis=1)
+        return padded_scene_box, self.crop_scale()
 
-        ## bbreg rois
-        batch_num = iidx * np.ones((cur_extra_bbreg_examples.shape[0], 1))
-        cur_extra_bbreg_rois = np.copy(cur_extra_bbreg_examples)
-        cur_extra_bbreg_rois[:,0:2] -= np.repeat(np.reshape(extra_scene_box[0:2],(1,2)),cur_extra_bbreg_rois.shape[0],axis=0)
-        cur_extra_bbreg_rois = samples2maskroi(cur_extra_bbreg_rois, model.receptive_field,(scaled_obj_size,scaled_obj_size), extra_target_bbox[2:4], opts['padding'])
-        cur_extra_bbreg_rois = np.concatenate((batch_num, cur_extra_bbreg_rois), axis=1)
+    def collect_extent(self, samples):
+        ## box covering the padded collection samples (see collect_scene) of a target averaged from samples
+        centers = samples[:,0:2] + samples[:,2:4]/2.
+        max_wh = samples[:,2:4].max(axis=0)
+        margin = self.collect_trans_f * max_wh.mean() + self.collect_scale_f * max_wh * opts['padding'] / 2.
+        x1y1 = centers.min(axis=0) - margin
+        x2y2 = centers.max(axis=0) + margin
+        return np.concatenate((x1y1, x2y2-x1y1))
 
+    def search_group(self, bidx, scene_box, scale):
+        ## build_rois group of the candidates on scene bidx, cropped from scene_box at scale
+        obj_size = self.target_bbox[2:4]
+        return self.samples, bidx, scene_box, scale*obj_size, obj_size
 
+    def estimate(self, feat_map, bidx, scene_box, scale):
+        ## score the candidates on scene bidx of feat_map, cropped from scene_box at scale
+        self.model.eval()
 
-        if iidx==0:
-            extra_cropped_image = cur_extra_cropped_image
+        # Extract sample features and get target location
+        sample_feats = group_features(self.model, feat_map, [self.search_group(bidx, scene_box, scale)])[0]
+        return self.locate(sample_feats)
 
-            extra_pos_rois = np.copy(cur_extra_pos_rois)
-            extra_neg_rois = np.copy(cur_extra_neg_rois)
-            ##bbreg rois
-            extra_bbreg_rois = np.copy(cur_extra_bbreg_rois)
-            extra_bbreg_examples = np.copy(cur_extra_bbreg_examples)
-        else:
-            extra_cropped_image = torch.cat((extra_cropped_image,cur_extra_cropped_image),dim=0)
+    def locate(self, sample_feats):
+        ## new target location from the features of the candidates
+        model = self.model
+        model.eval()
 
-            extra_pos_rois = np.concatenate( (extra_pos_rois, np.copy(cur_extra_pos_rois)), axis=0)
-            extra_neg_rois = np.concatenate( (extra_neg_rois, np.copy(cur_extra_neg_rois)), axis=0)
-            ##bbreg rois
-            extra_bbreg_rois = np.concatenate( (extra_bbreg_rois, np.copy(cur_extra_bbreg_rois)), axis=0 )
-            extra_bbreg_examples = np.concatenate( (extra_bbreg_examples, np.copy(cur_extra_bbreg_examples)), axis=0 )
+        with stage('score'):
+            with no_grad():
+                sample_scores = model.score(inference_variable(sample_feats), in_layer='fc4')
+            top_scores, top_idx = sample_scores[:,1].topk(5)
+            bbreg_feats = sample_feats.index_select(0, top_idx.data)
+            top_idx = top_idx.data.cpu().numpy()
+        self.target_score = top_scores.data.mean()
+        self.target_bbox = self.samples[top_idx].mean(axis=0)
 
+        self.success = self.target_score > opts['success_thr']
 
-    extra_pos_rois = Variable(torch.from_numpy(extra_pos_rois.astype('float32'))).cuda()
-    extra_neg_rois = Variable(torch.from_numpy(extra_neg_rois.astype('float32'))).cuda()
-    ##bbreg rois
-    extra_bbreg_rois = Variable(torch.from_numpy(extra_bbreg_rois.astype('float32'))).cuda()
+        # # Expand search area at failure
+        if self.success:
+            self.trans_f = opts['trans_f']
+        else:
+            self.trans_f = opts['trans_f_expand']
 
-    extra_cropped_image -= 128.
+        ## Bbox regression
+        if self.success:
+            with stage('bbreg'):
+                bbreg_samples = self.bbreg.predict(bbreg_feats, self.samples[top_idx])
+            self.bbreg_bbox = bbreg_samples.mean(axis=0)
+        else:
+            self.bbreg_bbox = self.target_bbox
+
+        return self.target_bbox, self.bbreg_bbox, self.target_score
+
+    def collect_scene(self, ishape):
+        ## draw pos/neg samples around the new target, returns the scene covering them and its crop scale
+        self.pos_examples = gen_samples(
+            SampleGenerator('gaussian', (ishape[1], ishape[0]), 0.1, 1.2), self.target_bbox,
+            opts['n_pos_update'],
+            opts['overlap_pos_update'])
+        self.neg_examples = gen_samples(
+            SampleGenerator('uniform', (ishape[1], ishape[0]), self.collect_trans_f, self.collect_scale_f), self.target_bbox,
+            opts['n_neg_update'],
+            opts['overlap_neg_update'])
+        examples = [self.pos_examples, self.neg_examples]
+
+        ## samples around the regressed box to refresh the bbox regressor
+        if opts['bbreg_update']:
+            self.bbreg_examples = gen_samples(
+                SampleGenerator('uniform', (ishape[1], ishape[0]), 0.3, 1.5, 1.1), self.bbreg_bbox,
+                opts['n_bbreg_update'], opts['overlap_bbreg'], opts['scale_bbreg'])
+            examples.append(self.bbreg_examples)
+
+        return get_padded_scene_box(np.concatenate(examples, axis=0)), self.crop_scale()
+
+    def collect_groups(self, bidx, scene_box, scale):
+        ## build_rois groups of the drawn pos/neg (and bbreg) samples, scene as in search_group
+        obj_size = self.target_bbox[2:4]
+        groups = [(self.pos_examples, bidx, scene_box, scale*obj_size, obj_size),
+                  (self.neg_examples, bidx, scene_box, scale*obj_size, obj_size)]
+        if opts['bbreg_update']:
+            groups.append((self.bbreg_examples, bidx, scene_box, scale*obj_size, obj_size))
+        return groups
+
+    def collect(self, feat_map, bidx, scene_box, scale):
+        ## store the features of the drawn samples, scene as in estimate
+        self.store(*group_features(self.model, feat_map, self.collect_groups(bidx, scene_box, scale)))
+
+    def store(self, pos_feats, neg_feats, bbreg_feats=None):
+        self.pos_memory.append(self.cache(pos_feats))
+        self.neg_memory.append(self.cache(neg_feats))
+        if bbreg_feats is not None:
+            self.bbreg.update(bbreg_feats, self.bbreg_examples, self.bbreg_bbox)
+
+    def update(self):
+        ## online update at the end of a frame
+        self.frame_num += 1
 
+        # Short term update
+        if not self.success:
+            nframes = min(opts['n_frames_short'],len(self.pos_memory))
+            with stage('train'):
+                train(self.model, self.criterion, self.update_optimizer, self.pos_memory.data, self.neg_memory.data, opts['maxiter_update'],
+                      self.update_in_layer, self.pos_memory.rows(nframes), self.neg_memory.rows())
 
-    extra_feat_maps = model(extra_cropped_image, out_layer='conv3')
-    # Draw pos/neg samples
-    ishape = cur_image.shape
+        # Long term update
+        elif self.frame_num % opts['long_interval'] == 0:
+            with stage('train'):
+                train(self.model, self.criterion, self.update_optimizer, self.pos_memory.data, self.neg_memory.data, opts['maxiter_update'],
+                      self.update_in_layer, self.pos_memory.rows(), self.neg_memory.rows())
+
+
+class Tracker():
+    '''
+    Stateful single target tracker working on in-memory frames
+        tracker = Tracker()
+        tracker.init(frame, bbox)
+        bbox, score = tracker.update(next_frame)
+    Frames are H x W x 3 RGB ndarrays, bboxes are [x,y,w,h].
+    '''
+
+    def __init__(self, model=None, img_crop_model=None):
+        if not opts['use_gpu'] and opts['n_threads'] > 0:
+            torch.set_num_threads(opts['n_threads'])
+
+        # Init model, it is kept untouched and copied for every new target
+        if model is None:
+            model = cached_model()
+        # Init image crop model
+        if img_crop_model is None:
+            img_crop_model = load_cropper()
+        self.base_model = model
+        self.img_crop_model = img_crop_model
+        self.target = None
+
+    def init(self, frame, bbox):
+        ## start tracking bbox in frame, trains the fc layers and the bbox regressor
+        self.target = Target(target_model(self.base_model), self.img_crop_model, frame, bbox)
+        ## the frame was uploaded once for all its crops, it is not kept past the call
+        self.img_crop_model.invalidate()
+        if opts['use_gpu']:
+            torch.cuda.empty_cache()
+
+    def update(self, frame):
+        ## track the target in the next frame, returns the regressed bbox and its score
+        assert self.target is not None, "Tracker.init has to be called first"
+        target = self.target
+        model = target.model
+        ishape = frame.shape
 
+        # Estimate target bbox
+        padded_scene_box, scale = target.search_scene(ishape)
+        feat_map = scene_feat_maps(model, self.img_crop_model, frame, np.reshape(padded_scene_box,(1,4)), np.reshape(padded_scene_box[2:4]*scale,(1,2)))
+        target.estimate(feat_map, 0, padded_scene_box, scale)
 
-    extra_pos_feats = model.roi_align_model(extra_feat_maps, extra_pos_rois)
-    extra_pos_feats = extra_pos_feats.view(extra_pos_feats.size(0), -1).data.clone()
+        # Data collect
+        if target.success:
+            with stage('collect'):
+                collect_scene_box, collect_scale = target.collect_scene(ishape)
+                if not (opts['shared_collect_crop'] and box_covers(padded_scene_box, collect_scene_box)):
+                    padded_scene_box, scale = collect_scene_box, collect_scale
+                    feat_map = scene_feat_maps(model, self.img_crop_model, frame, np.reshape(padded_scene_box,(1,4)), np.reshape(padded_scene_box[2:4]*scale,(1,2)))
+                target.collect(feat_map, 0, padded_scene_box, scale)
+        self.img_crop_model.invalidate()
+
+        target.update()
+        return target.bbreg_bbox, target.target_score
+
+
+def track(frames, init_bbox, tracker=None):
+    '''
+    Generator over the tracking results of a frame iterator
+    - frames: any iterable of H x W x 3 RGB ndarrays, the target is given in the first one
+    Yields (bbox, score) for every frame, the score of the first frame is None.
+    '''
+
+    if tracker is None:
+        tracker = Tracker()
+    frames = iter(frames)
+    tracker.init(next(frames), init_bbox)
+    yield np.array(init_bbox), None
+    for frame in frames:
+        yield tracker.update(frame)
 
-    extra_neg_feats = model.roi_align_model(extra_feat_maps, extra_neg_rois)
-    extra_neg_feats = extra_neg_feats.view(extra_neg_feats.size(0), -1).data.clone()
-    ##bbreg feat
-    extra_bbreg_feats = model.roi_align_model(extra_feat_maps, extra_bbreg_rois)
-    extra_bbreg_feats = extra_bbreg_feats.view(extra_bbreg_feats.size(0), -1).data.clone()
 
-    ## concatenate extra features to original_features
-    pos_feats = torch.cat((pos_feats,extra_pos_feats),dim=0)
-    neg_feats = torch.cat((neg_feats,extra_neg_feats), dim=0)
-    ## concatenate extra bbreg feats to original_bbreg_feats
-    bbreg_feats = torch.cat((bbreg_feats, extra_bbreg_feats), dim=0)
-    bbreg_examples = np.concatenate((bbreg_examples, extra_bbreg_examples), axis=0)
+def run_mdnet(img_list, init_bbox, gt=None, seq='seq_name ex)Basketball', savefig_dir='', display=False):
+    ## with opts['profile_stages'] the per frame stage times are left in stage_timer (see modules/profiler.py)
 
-    torch.cuda.empty_cache()
-    model.zero_grad()
+    ############################################
+    ############################################
+    ############################################
+    # Init bbox
+    target_bbox = np.array(init_bbox)
+    result = np.zeros((len(img_list),4))
+    result_bb = np.zeros((len(img_list),4))
+    result[0] = np.copy(target_bbox)
+    result_bb[0] = np.copy(target_bbox)
 
-    # Initial training
-    train(model, criterion, init_optimizer, pos_feats, neg_feats, opts['maxiter_init'])
+    iou_result = np.zeros((len(img_list),1))
 
-    ##bbreg train
-    if bbreg_feats.size(0) > opts['n_bbreg']:
-        bbreg_idx = np.asarray(range(bbreg_feats.size(0)))
-        np.random.shuffle(bbreg_idx)
-        bbreg_feats = bbreg_feats[bbreg_idx[0:opts['n_bbreg']],:]
-        bbreg_examples = bbreg_examples[bbreg_idx[0:opts['n_bbreg']],:]
-    bbreg = BBRegressor((ishape[1],ishape[0]))
-    bbreg.train(bbreg_feats, bbreg_examples, target_bbox)
+    # execution time array
+    exec_time_result = np.zeros((len(img_list),1))
 
+    tracker = Tracker()
 
-    if pos_feats.size(0) > opts['n_pos_update']:
-        pos_idx = np.asarray(range(pos_feats.size(0)))
-        np.random.shuffle(pos_idx)
-        pos_feats_all = [pos_feats.index_select(0, torch.from_numpy(pos_idx[0:opts['n_pos_update']]).cuda())]
-    if neg_feats.size(0) > opts['n_neg_update']:
-        neg_idx = np.asarray(range(neg_feats.size(0)))
-        np.random.shuffle(neg_idx)
-        neg_feats_all = [neg_feats.index_select(0, torch.from_numpy(neg_idx[0:opts['n_neg_update']]).cuda())]
+    ## frames are decoded by background workers while the previous one is tracked
+    frames = open_frames(img_list, opts['n_prefetch'], opts['n_decode_workers'])
 
+    stage_timer.reset(opts['profile_stages'], opts['use_gpu'])
+    stage_timer.new_frame()
+
+    tic = time.time()
+    # Load first image
+    with stage('load'):
+        cur_image = next(frames)
+    tracker.init(cur_image, target_bbox)
 
     spf_total = time.time()-tic
     #spf_total = 0. # no first frame
@@ -437,176 +739,30 @@ def run_mdnet(img_list, init_bbox, gt=None, seq='seq_name ex)Basketball', savefi
             fig.savefig(os.path.join(savefig_dir,'0000.jpg'),dpi=dpi)
 
     # Main loop
-    trans_f = opts['trans_f']
+    n_frames = len(img_list)
     for i in range(1,len(img_list)):
 
+        stage_timer.new_frame()
         tic = time.time()
         # Load image
-        cur_image = Image.open(img_list[i]).convert('RGB')
-        cur_image = np.asarray(cur_image)
+        try:
+            with stage('load'):
+                cur_image = next(frames)
+        except StopIteration:
+            ## a video ended before its probed length, the results stop at its last frame
+            print "%s: the frames ended after %d of %d, results are truncated" % (seq, i, len(img_list))
+            n_frames = i
+            del stage_timer.frames[n_frames:]
+            break
 
         # Estimate target bbox
-        ishape = cur_image.shape
-        samples = gen_samples(SampleGenerator('gaussian', (ishape[1], ishape[0]), trans_f, opts['scale_f'],valid=True), target_bbox, opts['n_samples'])
-
-        padded_x1 = (samples[:, 0] - samples[:, 2]*(opts['padding']-1.)/2.).min()
-        padded_y1 = (samples[:, 1] - samples[:,3]*(opts['padding']-1.)/2.).min()
-        padded_x2 = (samples[:, 0] + samples[:, 2]*(opts['padding']+1.)/2.).max()
-        padded_y2 = (samples[:, 1] + samples[:, 3]*(opts['padding']+1.)/2.).max()
-        padded_scene_box = np.asarray((padded_x1, padded_y1, padded_x2 - padded_x1, padded_y2 - padded_y1))
-
-        if padded_scene_box[0] > cur_image.shape[1]:
-            padded_scene_box[0] = cur_image.shape[1]-1
-        if padded_scene_box[1] > cur_image.shape[0]:
-            padded_scene_box[1] = cur_image.shape[0]-1
-        if padded_scene_box[0] + padded_scene_box[2] < 0:
-            padded_scene_box[2] = -padded_scene_box[0]+1
-        if padded_scene_box[1] + padded_scene_box[3] < 0:
-            padded_scene_box[3] = -padded_scene_box[1]+1
-
-
-        crop_img_size = (padded_scene_box[2:4] * ((opts['img_size'], opts['img_size']) / target_bbox[2:4])).astype(
-            'int64')
-        cropped_image,cur_image_var = img_crop_model.crop_image(cur_image, np.reshape(padded_scene_box,(1,4)),crop_img_size)
-        cropped_image = cropped_image - 128.
-
-        model.eval()
-        feat_map = model(cropped_image, out_layer='conv3')
-
-        # relative target bbox with padded_scene_box
-        rel_target_bbox = np.copy(target_bbox)
-        rel_target_bbox[0:2] -= padded_scene_box[0:2]
-
-
-        # Extract sample features and get target location
-        batch_num = np.zeros((samples.shape[0], 1))
-        sample_rois = np.copy(samples)
-        sample_rois[:, 0:2] -= np.repeat(np.reshape(padded_scene_box[0:2], (1, 2)), sample_rois.shape[0], axis=0)
-        sample_rois = samples2maskroi(sample_rois,model.receptive_field, (opts['img_size'],opts['img_size']), target_bbox[2:4],opts['padding'])
-        sample_rois = np.concatenate((batch_num, sample_rois), axis=1)
-        sample_rois = Variable(torch.from_numpy(sample_rois.astype('float32'))).cuda()
-        sample_feats = model.roi_align_model(feat_map, sample_rois)
-        sample_feats = sample_feats.view(sample_feats.size(0), -1).clone()
-        sample_scores = model(sample_feats, in_layer='fc4')
-        top_scores, top_idx = sample_scores[:,1].topk(5)
-        top_idx = top_idx.data.cpu().numpy()
-        target_score = top_scores.data.mean()
-        target_bbox = samples[top_idx].mean(axis=0)
-
-        success = target_score > opts['success_thr']
-
-        # # Expand search area at failure
-        if success:
-            trans_f = opts['trans_f']
-        else:
-            trans_f = opts['trans_f_expand']
-
-        ## Bbox regression
-        if success:
-            bbreg_feats = sample_feats[top_idx,:]
-            bbreg_samples = samples[top_idx]
-            bbreg_samples = bbreg.predict(bbreg_feats.data, bbreg_samples)
-            bbreg_bbox = bbreg_samples.mean(axis=0)
-        else:
-            bbreg_bbox = target_bbox
+        bbreg_bbox, target_score = tracker.update(cur_image)
 
         # Save result
-        result[i] = target_bbox
+        result[i] = tracker.target.target_bbox
         result_bb[i] = bbreg_bbox
         iou_result[i] = 1.
 
-        # Data collect
-        if success:
-
-            # Draw pos/neg samples
-            pos_examples = gen_samples(
-                SampleGenerator('gaussian', (ishape[1], ishape[0]), 0.1, 1.2), target_bbox,
-                opts['n_pos_update'],
-                opts['overlap_pos_update'])
-            neg_examples = gen_samples(
-                SampleGenerator('uniform', (ishape[1], ishape[0]), 1.5, 1.2), target_bbox,
-                opts['n_neg_update'],
-                opts['overlap_neg_update'])
-
-            padded_x1 = (neg_examples[:, 0] - neg_examples[:, 2] * (opts['padding'] - 1.) / 2.).min()
-            padded_y1 = (neg_examples[:, 1] - neg_examples[:, 3] * (opts['padding'] - 1.) / 2.).min()
-            padded_x2 = (neg_examples[:, 0] + neg_examples[:, 2] * (opts['padding'] + 1.) / 2.).max()
-            padded_y2 = (neg_examples[:, 1] + neg_examples[:, 3] * (opts['padding'] + 1.) / 2.).max()
-            padded_scene_box = np.reshape(np.asarray((padded_x1, padded_y1, padded_x2 - padded_x1, padded_y2 - padded_y1)),(1,4))
-
-            scene_boxes = np.reshape(np.copy(padded_scene_box), (1, 4))
-            jitter_scale = [1.]
-
-            for bidx in range(0, scene_boxes.shape[0]):
-                crop_img_size = (scene_boxes[bidx, 2:4] * ((opts['img_size'], opts['img_size']) / target_bbox[2:4])).astype('int64') * jitter_scale[bidx]
-                cropped_image, cur_image_var = img_crop_model.crop_image(cur_image,np.reshape(scene_boxes[bidx], (1, 4)),crop_img_size)
-                cropped_image = cropped_image - 128.
-
-                feat_map = model(cropped_image, out_layer='conv3')
-
-                rel_target_bbox = np.copy(target_bbox)
-                rel_target_bbox[0:2] -= scene_boxes[bidx, 0:2]
-
-                batch_num = np.zeros((pos_examples.shape[0], 1))
-                cur_pos_rois = np.copy(pos_examples)
-                cur_pos_rois[:, 0:2] -= np.repeat(np.reshape(scene_boxes[bidx, 0:2], (1, 2)), cur_pos_rois.shape[0],axis=0)
-                scaled_obj_size = float(opts['img_size']) * jitter_scale[bidx]
-                cur_pos_rois = samples2maskroi(cur_pos_rois, model.receptive_field, (scaled_obj_size, scaled_obj_size),target_bbox[2:4], opts['padding'])
-                cur_pos_rois = np.concatenate((batch_num, cur_pos_rois), axis=1)
-                cur_pos_rois = Variable(torch.from_numpy(cur_pos_rois.astype('float32'))).cuda()
-                cur_pos_feats = model.roi_align_model(feat_map, cur_pos_rois)
-                cur_pos_feats = cur_pos_feats.view(cur_pos_feats.size(0), -1).data.clone()
-
-                batch_num = np.zeros((neg_examples.shape[0], 1))
-                cur_neg_rois = np.copy(neg_examples)
-                cur_neg_rois[:, 0:2] -= np.repeat(np.reshape(scene_boxes[bidx, 0:2], (1, 2)), cur_neg_rois.shape[0],
-                                                  axis=0)
-                cur_neg_rois = samples2maskroi(cur_neg_rois, model.receptive_field, (scaled_obj_size, scaled_obj_size),
-                                               target_bbox[2:4], opts['padding'])
-                cur_neg_rois = np.concatenate((batch_num, cur_neg_rois), axis=1)
-                cur_neg_rois = Variable(torch.from_numpy(cur_neg_rois.astype('float32'))).cuda()
-                cur_neg_feats = model.roi_align_model(feat_map, cur_neg_rois)
-                cur_neg_feats = cur_neg_feats.view(cur_neg_feats.size(0), -1).data.clone()
-
-                feat_dim = cur_pos_feats.size(-1)
-
-                if bidx == 0:
-                    pos_feats = cur_pos_feats ##index select
-                    neg_feats = cur_neg_feats
-                else:
-                    pos_feats = torch.cat((pos_feats, cur_pos_feats), dim=0)
-                    neg_feats = torch.cat((neg_feats, cur_neg_feats), dim=0)
-
-            if pos_feats.size(0) > opts['n_pos_update']:
-                pos_idx = np.asarray(range(pos_feats.size(0)))
-                np.random.shuffle(pos_idx)
-                pos_feats = pos_feats.index_select(0, torch.from_numpy(pos_idx[0:opts['n_pos_update']]).cuda())
-            if neg_feats.size(0) > opts['n_neg_update']:
-                neg_idx = np.asarray(range(neg_feats.size(0)))
-                np.random.shuffle(neg_idx)
-                neg_feats = neg_feats.index_select(0,torch.from_numpy(neg_idx[0:opts['n_neg_update']]).cuda())
-
-            pos_feats_all.append(pos_feats)
-            neg_feats_all.append(neg_feats)
-
-            if len(pos_feats_all) > opts['n_frames_long']:
-                del pos_feats_all[0]
-            if len(neg_feats_all) > opts['n_frames_short']:
-                del neg_feats_all[0]
-
-        # Short term update
-        if not success:
-            nframes = min(opts['n_frames_short'],len(pos_feats_all))
-            pos_data = torch.stack(pos_feats_all[-nframes:],0).view(-1,feat_dim)
-            neg_data = torch.stack(neg_feats_all,0).view(-1,feat_dim)
-            train(model, criterion, update_optimizer, pos_data, neg_data, opts['maxiter_update'])
-
-        # Long term update
-        elif i % opts['long_interval'] == 0:
-            pos_data = torch.stack(pos_feats_all,0).view(-1,feat_dim)
-            neg_data = torch.stack(neg_feats_all,0).view(-1,feat_dim)
-            train(model, criterion, update_optimizer, pos_data, neg_data, opts['maxiter_update'])
-
         spf = time.time()-tic
         spf_total += spf
 
@@ -639,6 +795,13 @@ def run_mdnet(img_list, init_bbox, gt=None, seq='seq_name ex)Basketball', savefi
         iou_result[i]= overlap_ratio(gt[i],result_bb[i])[0]
 
 
-    fps = len(img_list) / spf_total
+    frames.close()
+    result, result_bb, iou_result = result[0:n_frames], result_bb[0:n_frames], iou_result[0:n_frames]
+    if opts['visual_log']:
+        print "Waited %.3f s for frames (%.4f s/frame)" % (frames.total_stall(), frames.total_stall()/n_frames)
+        if opts['profile_stages']:
+            print stage_timer.report()
+
+    fps = n_frames / spf_total
     #fps = (len(img_list)-1) / spf_total #no first frame
     return iou_result, result_bb, fps, result
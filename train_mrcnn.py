@@ -34,8 +34,6 @@ def genConfig(seq_path, set_type):
     path, seqname = os.path.split(seq_path)
 
     if set_type == 'OTB':
-        img_list = sorted([seq_path + '/img/' + p for p in os.listdir(seq_path + '/img') if os.path.splitext(p)[1] == '.jpg'])
-
         if (seqname == 'Jogging') or (seqname == 'Skating2'):
             gt = np.loadtxt(seq_path + '/groundtruth_rect.1.txt')
         elif seqname =='Human4':
@@ -53,18 +51,32 @@ def genConfig(seq_path, set_type):
         else:
             gt = np.loadtxt(seq_path + '/groundtruth_rect.txt', delimiter=',')
 
+        ## frames [start, stop) of the sequence
+        start, stop = 0, None
         if seqname == 'David':
-            img_list = img_list[300:]
+            start = 300
             # gt = gt[300:,:]
         if seqname == 'Football1':
-            img_list = img_list[0:73]
+            stop = 73
         if seqname == 'Freeman3':
-            img_list = img_list[0:459]
+            stop = 459
         if seqname == 'Freeman4':
-            img_list = img_list[0:282]
+            stop = 282
+
+        ## a video file in the sequence directory is streamed directly, seeking to start
+        video_path = find_video(seq_path)
+        if video_path is not None:
+            img_list = VideoFrameSource(video_path, start, stop)
+        else:
+            img_list = sorted([seq_path + '/img/' + p for p in os.listdir(seq_path + '/img') if os.path.splitext(p)[1] == '.jpg'])
+            img_list = img_list[start:stop]
 
     elif set_type=='VOT/2016':
-        img_list = sorted([seq_path + '/'+p for p in os.listdir(seq_path) if os.path.splitext(p)[1] == '.jpg'])
+        video_path = find_video(seq_path)
+        if video_path is not None:
+            img_list = VideoFrameSource(video_path)
+        else:
+            img_list = sorted([seq_path + '/'+p for p in os.listdir(seq_path) if os.path.splitext(p)[1] == '.jpg'])
         gt = np.loadtxt(seq_path + '/groundtruth.txt', delimiter=',')
 
         ##polygon to rect
@@ -151,19 +163,19 @@ def train_mdnet():
                     cur_pos_rois = pos_rois[sidx]
                     cur_neg_rois = neg_rois[sidx]
 
+                    ## pos and neg rois are transferred and aligned together
+                    n_pos = cur_pos_rois.size(0)
                     cur_scene = Variable(cur_scene)
-                    cur_pos_rois = Variable(cur_pos_rois)
-                    cur_neg_rois = Variable(cur_neg_rois)
+                    cur_rois = Variable(torch.cat((cur_pos_rois, cur_neg_rois), 0))
                     if pretrain_opts['use_gpu']:
                         cur_scene = cur_scene.cuda()
-                        cur_pos_rois = cur_pos_rois.cuda()
-                        cur_neg_rois = cur_neg_rois.cuda()
+                        cur_rois = cur_rois.cuda()
                     cur_feat_map = model(cur_scene, k, out_layer='conv3')
 
-                    cur_pos_feats = model.roi_align_model(cur_feat_map, cur_pos_rois)
-                    cur_pos_feats = cur_pos_feats.view(cur_pos_feats.size(0), -1)
-                    cur_neg_feats = model.roi_align_model(cur_feat_map, cur_neg_rois)
-                    cur_neg_feats = cur_neg_feats.view(cur_neg_feats.size(0), -1)
+                    cur_feats = model.roi_align_model(cur_feat_map, cur_rois)
+                    cur_feats = cur_feats.view(cur_feats.size(0), -1)
+                    cur_pos_feats = cur_feats[:n_pos]
+                    cur_neg_feats = cur_feats[n_pos:]
 
                     if sidx == 0:
                         pos_feats = [cur_pos_feats]
@@ -186,7 +198,7 @@ def train_mdnet():
             ## inter frame classification
 
             interclass_label = Variable(torch.zeros((pos_score.size(0))).long())
-            if opts['use_gpu']:
+            if pretrain_opts['use_gpu']:
                 interclass_label = interclass_label.cuda()
             total_interclass_score = pos_score[:,1].contiguous()
             total_interclass_score = total_interclass_score.view((pos_score.size(0),1))